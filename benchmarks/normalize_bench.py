@@ -0,0 +1,88 @@
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_normalizer import clean_meta_text, normalize_batch, normalize_for_search
+
+
+# Прежние реализации — эталон для побайтного сравнения и замера ускорения
+def legacy_normalize_for_search(text: Optional[Any]) -> str:
+    if not text: return ""
+    text_str = str(text).lower()
+    text_str = re.sub(r'(цена от|ціна від|price from)\s*[^-\|\n\r<]+?(\s*[-\|]|$)', ' ', text_str, flags=re.IGNORECASE)
+    text_str = re.sub(r'%[a-z_]+price[a-z_]*%', ' ', text_str)
+    text_str = re.sub(r'%[a-z_]+%', ' ', text_str)
+    text_str = re.sub(r'\d+(\.\d+)?\s*(грн|uah|usd|eur)?', ' ', text_str)
+    text_str = re.sub(r'[/\\|\-–—]', ' ', text_str)
+    text_str = re.sub(r'[\s\u00a0\u200b]+', ' ', text_str)
+    text_str = re.sub(r'[^\w\s]', '', text_str, flags=re.UNICODE)
+    text_str = re.sub(r'\s+', ' ', text_str)
+    return text_str.strip()
+
+
+def legacy_clean_text(text):
+    text = str(text).lower()
+    text = re.sub(r'%min_price%', '', text)
+    text = re.sub(r'цена от [^|\n\r-]+', '', text)
+    text = re.sub(r'цiна вiд [^|\n\r-]+', '', text)
+    text = re.sub(r'[\-\|:,⭐⏩⚡🔹📦→®]', '', text)
+    text = re.sub(r'грн|uah', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+SAMPLE_FRAGMENTS = ['Купить', 'таблетки', 'Нурофен', 'цена от 120 грн', 'Ціна від 99.50 UAH |', 'price from 10 usd -', '%min_price%',
+                    '%product_price_min%', '%name%', '— доставка', 'по Украине', '⭐', '⏩', 'Аптека №1', '24/7', 'C:\\путь',
+                    'zero\u200bwidth', 'A\u00a0B', '®', '→', 'цiна вiд 5 грн', '12.5 eur', 'отзывы: 4,8', '(акция!)', 'Київ', 'ё', 'ʼ',
+                    'ЦЕНА ОТ 7 ГРН -', 'PRICE FROM', 'prıce from 3 |', 'цена ᲂт 9', 'ціна ᲀід 1', 'İ', '_']
+
+
+def build_samples(count: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(SAMPLE_FRAGMENTS) for _ in range(rng.randint(1, 40))) for _ in range(count)]
+
+
+def measure(function: Callable[[Any], str], samples: List[str], repeats: int) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for sample in samples:
+            function(sample)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def compare(name: str, legacy: Callable[[Any], str], current: Callable[[Any], str], samples: List[str], repeats: int) -> bool:
+    mismatches = [sample for sample in samples if legacy(sample).encode('utf-8') != current(sample).encode('utf-8')]
+    legacy_seconds = measure(legacy, samples, repeats)
+    current_seconds = measure(current, samples, repeats)
+    print(f"{name}: старая {legacy_seconds * 1000:.1f} мс, новая {current_seconds * 1000:.1f} мс, "
+          f"ускорение x{legacy_seconds / current_seconds:.2f}, расхождений: {len(mismatches)}")
+    for sample in mismatches[:5]:
+        print(f"  {sample!r}: {legacy(sample)!r} != {current(sample)!r}")
+    return not mismatches
+
+
+def main(count: int = 20000, repeats: int = 5) -> int:
+    samples = build_samples(count)
+    edge_cases: List[Optional[Any]] = [None, '', 0, float('nan'), '  ', '%a%bprice%', 'цiна вiд цена от x', 'uaгрнh', 'грuahн']
+    identical = all(legacy_normalize_for_search(value) == normalize_for_search(value) for value in edge_cases)
+    identical = all(legacy_clean_text(value) == clean_meta_text(value) for value in edge_cases if value is not None) and identical
+    identical = compare('normalize_for_search', legacy_normalize_for_search, normalize_for_search, samples, repeats) and identical
+    identical = compare('clean_text', legacy_clean_text, clean_meta_text, samples, repeats) and identical
+    duplicated_samples = samples[:count // 10] * 10
+    started = time.perf_counter()
+    batch_result = normalize_batch(duplicated_samples)
+    batch_seconds = time.perf_counter() - started
+    identical = batch_result == [legacy_normalize_for_search(sample) for sample in duplicated_samples] and identical
+    print(f"normalize_batch на {len(duplicated_samples)} строк (10% уникальных): {batch_seconds * 1000:.1f} мс")
+    print("Результат побайтно совпадает" if identical else "ЕСТЬ РАСХОЖДЕНИЯ")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import os
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+from typing import List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_normalizer import clean_meta_text, normalize_batch
+from text_similarity import SIMILARITY_MATCH_THRESHOLD, SIMILARITY_PARTIAL_THRESHOLD, batch_similarity
+
+
+# Прежняя реализация из вкладки «Tittle_Description +» — эталон скорости и шкалы, под которую стояли пороги 80/50
+def legacy_get_similarity(text1, text2):
+    return round(SequenceMatcher(None, text1, text2).ratio() * 100, 1)
+
+
+# С этой длины SequenceMatcher включает autojunk, и его оценка перестаёт быть эталоном
+SEQUENCE_MATCHER_AUTOJUNK_MIN_LEN = 200
+
+WORDS = ['купить', 'таблетки', 'нурофен', 'в', 'аптеке', 'цена', 'от', 'грн', 'доставка', 'по', 'украине', 'отзывы',
+         'инструкция', 'аналоги', 'купити', 'ціна', 'доставка', 'київ', 'аптека', '9-1-1', '⭐', 'мазь', 'крем', 'сироп']
+
+
+def build_rows(count: int, unchanged_share: float, seed: int = 7) -> Tuple[List[str], List[str]]:
+    # unchanged_share — доля строк, где мета на сайте совпадает с таблицей (в реальных выгрузках таких большинство)
+    rng = random.Random(seed)
+    expected, site = [], []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.choice([8, 12, 25, 40]))]
+        expected.append(' '.join(words))
+        if rng.random() < unchanged_share:
+            site.append(' '.join(words)); continue
+        edited = [word for word in words if rng.random() > 0.15] + [rng.choice(WORDS) for _ in range(rng.randint(0, 4))]
+        site.append(' '.join(edited) if rng.random() > 0.05 else rng.choice(['', 'страница не найдена']))
+    return expected, site
+
+
+def bucket(scores: np.ndarray, match_threshold: float, partial_threshold: float) -> np.ndarray:
+    return np.where(scores >= match_threshold, 2, np.where(scores >= partial_threshold, 1, 0))
+
+
+def run_case(count: int, unchanged_share: float) -> float:
+    expected_raw, site_raw = build_rows(count, unchanged_share)
+    expected, site = normalize_batch(expected_raw, clean_meta_text), normalize_batch(site_raw, clean_meta_text)
+
+    started = time.perf_counter()
+    legacy_scores = np.array([legacy_get_similarity(left, right) for left, right in zip(expected, site)])
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch_scores = batch_similarity(expected, site)
+    batch_seconds = time.perf_counter() - started
+
+    same_bucket = bucket(batch_scores, SIMILARITY_MATCH_THRESHOLD, SIMILARITY_PARTIAL_THRESHOLD) == bucket(legacy_scores, 80, 50)
+    short = np.array([max(len(left), len(right)) < SEQUENCE_MATCHER_AUTOJUNK_MIN_LEN for left, right in zip(expected, site)])
+    short_agreement = same_bucket[short].mean() if short.any() else 1.0
+    print(f"{count} строк, без изменений {unchanged_share:.0%}: SequenceMatcher {legacy_seconds * 1000:.0f} мс, "
+          f"batch_similarity {batch_seconds * 1000:.0f} мс, ускорение x{legacy_seconds / batch_seconds:.1f}; "
+          f"та же оценка ✅/🟡/❌: {same_bucket.mean():.1%} строк, {short_agreement:.1%} строк короче "
+          f"{SEQUENCE_MATCHER_AUTOJUNK_MIN_LEN} символов")
+    return short_agreement
+
+
+def main(count: int = 10000) -> int:
+    agreements = [run_case(count, unchanged_share) for unchanged_share in (0.0, 0.5, 0.8)]
+    calibrated = min(agreements) >= 0.99 and batch_similarity([''], [''])[0] == legacy_get_similarity('', '') == 100.0
+    print("Пороги совпадают с прежней шкалой" if calibrated else "ОШИБКА: пороги нужно перекалибровать")
+    return 0 if calibrated else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
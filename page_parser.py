@@ -0,0 +1,200 @@
+import codecs
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple, Union
+import lxml.html
+from lxml import etree
+
+# --- ПРАВИЛА ИЗВЛЕЧЕНИЯ ОСНОВНОГО ТЕКСТА ---
+MAIN_CONTENT_SELECTORS = ['article', 'main', '.main-content', '.content', '.post-content', '.entry-content', '#content', '.b-content__body', '.js-mediator-article', '.product-description', '.page-content']
+SOURCE_TAGS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'span', 'td', 'th', 'strong', 'em', 'b', 'i', 'div'])
+DIV_CONTENT_CHILD_TAGS = frozenset(['p', 'li', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+NOISY_CLASSES = frozenset(['advert', 'social', 'comment', 'sidebar', 'menu', 'nav', 'footer', 'header', 'modal', 'popup', 'banner', 'widget', 'related-posts', 'author-bio', 'breadcrumb', 'pagination', 'meta', 'hidden', 'sr-only', 'price', 'tools', 'actions', 'rating', 'tags', 'share', 'author', 'date', 'category', 'edit-link', 'reply', 'navigation', 'top-link', 'skip-link', 'visually-hidden', 'cookie', 'alert', 'dropdown', 'tab'])
+NOISY_TAGS_IN_PARENTS = frozenset(['script', 'style', 'nav', 'footer', 'aside', 'header', 'form', 'button', 'select', 'textarea', 'iframe', 'noscript', 'svg', 'figure', 'figcaption', 'address'])
+# Строки внутри этих тегов BeautifulSoup не отдаёт в get_text() (Script, Stylesheet, TemplateString, Ruby*)
+NON_TEXT_TAGS = frozenset(['script', 'style', 'template', 'rt', 'rp'])
+
+_HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+
+def parse_html_document(html_source: Union[str, bytes]) -> Optional[etree._Element]:
+    if isinstance(html_source, bytes):
+        html_source = html_source.decode('utf-8', errors='replace')
+    if not html_source or not html_source.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html_source.encode('utf-8'), parser=_HTML_PARSER)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _has_noisy_class(element: etree._Element) -> bool:
+    class_attr = element.get('class')
+    return bool(class_attr) and any(cls in NOISY_CLASSES for cls in class_attr.split())
+
+
+def extract_meta(root: etree._Element) -> Tuple[str, str]:
+    title_tag = next(root.iter('title'), None)
+    page_title = title_tag.text_content().strip() if title_tag is not None else ''
+    description_tag = next((meta for meta in root.iter('meta') if meta.get('name') == 'description'), None)
+    page_desc = description_tag.get('content').strip() if description_tag is not None and description_tag.get('content') else ''
+    return page_title, page_desc
+
+
+def find_content_area(root: etree._Element) -> Tuple[Optional[etree._Element], Optional[str]]:
+    # Первый элемент в порядке документа для каждого селектора, затем — по приоритету селекторов
+    first_match: Dict[str, etree._Element] = {}
+    for element in root.iter(etree.Element):
+        if element.tag not in first_match and element.tag in MAIN_CONTENT_SELECTORS:
+            first_match[element.tag] = element
+        class_attr = element.get('class')
+        if class_attr:
+            for cls in class_attr.split():
+                selector = '.' + cls
+                if selector not in first_match and selector in MAIN_CONTENT_SELECTORS:
+                    first_match[selector] = element
+        element_id = element.get('id')
+        if element_id and '#' + element_id not in first_match and '#' + element_id in MAIN_CONTENT_SELECTORS:
+            first_match['#' + element_id] = element
+        if MAIN_CONTENT_SELECTORS[0] in first_match:
+            break
+    for selector in MAIN_CONTENT_SELECTORS:
+        if selector in first_match:
+            return first_match[selector], selector
+    return None, None
+
+
+def _collect_text_spans(container: etree._Element) -> Tuple[List[str], List[Tuple[etree._Element, int, int, bool]]]:
+    # Один проход сверху вниз: все строки узлов складываются в общий список один раз,
+    # для каждого элемента запоминается срез [start, end) этого списка и признак «шумного» окружения.
+    strings: List[str] = []
+    spans: List[Tuple[etree._Element, int, int, bool]] = []
+    container_noisy = any(ancestor.tag in NOISY_TAGS_IN_PARENTS or _has_noisy_class(ancestor)
+                          for ancestor in container.iterancestors())
+    container_in_non_text = container.tag in NON_TEXT_TAGS or any(ancestor.tag in NON_TEXT_TAGS for ancestor in container.iterancestors())
+    container_noisy = container_noisy or container.tag in NOISY_TAGS_IN_PARENTS or _has_noisy_class(container)
+
+    if container.text and not container_in_non_text:
+        stripped = container.text.strip()
+        if stripped: strings.append(stripped)
+    # Элементы стека: (элемент, шумный_родитель, в_не_текстовом_теге, индекс_в_spans | None для хвоста)
+    stack: List[Tuple[Any, bool, bool, Optional[int]]] = [(child, container_noisy, container_in_non_text, None)
+                                                        for child in reversed(container)]
+    while stack:
+        element, parent_noisy, parent_non_text, span_index = stack.pop()
+        if span_index is not None:
+            # Закрытие элемента: фиксируем конец его текста, затем хвост принадлежит родителю
+            span_element, span_start, _, span_noisy = spans[span_index]
+            spans[span_index] = (span_element, span_start, len(strings), span_noisy)
+            if element.tail and not parent_non_text:
+                stripped = element.tail.strip()
+                if stripped: strings.append(stripped)
+            continue
+        if not isinstance(element.tag, str):
+            if element.tail and not parent_non_text:
+                stripped = element.tail.strip()
+                if stripped: strings.append(stripped)
+            continue
+        self_noisy = _has_noisy_class(element)
+        in_non_text = parent_non_text or element.tag in NON_TEXT_TAGS
+        spans.append((element, len(strings), len(strings), parent_noisy or self_noisy))
+        stack.append((element, parent_noisy, parent_non_text, len(spans) - 1))
+        if element.text and not in_non_text:
+            stripped = element.text.strip()
+            if stripped: strings.append(stripped)
+        children_noisy = parent_noisy or self_noisy or element.tag in NOISY_TAGS_IN_PARENTS
+        for child in reversed(element):
+            stack.append((child, children_noisy, in_non_text, None))
+    return strings, spans
+
+
+def extract_main_text(root: etree._Element, content_area: Optional[etree._Element] = None) -> str:
+    container = content_area if content_area is not None else root
+    strings, spans = _collect_text_spans(container)
+    prefix_lengths = [0]
+    for text_piece in strings:
+        prefix_lengths.append(prefix_lengths[-1] + len(text_piece))
+
+    content_parts = []
+    for element, start, end, is_noisy in spans:
+        if is_noisy or element.tag not in SOURCE_TAGS:
+            continue
+        if element.tag == 'div' and prefix_lengths[end] - prefix_lengths[start] < 50 \
+                and not any(child.tag in DIV_CONTENT_CHILD_TAGS for child in element):
+            continue
+        tag_text = ' '.join(strings[start:end])
+        if element.tag in ('span', 'div') and len(tag_text.split()) < 3 and not any(c.isdigit() for c in tag_text):
+            if len(tag_text) < 15: continue
+        if tag_text: content_parts.append(tag_text)
+    return ' '.join(content_parts)
+
+
+def extract_page_fields(html_source: Union[str, bytes]) -> Dict[str, Any]:
+    root = parse_html_document(html_source)
+    if root is None:
+        return {'title': '', 'description': '', 'content': '', 'content_selector': None}
+    page_title, page_desc = extract_meta(root)
+    content_area, content_selector = find_content_area(root)
+    content = extract_main_text(root, content_area)
+    return {'title': page_title, 'description': page_desc, 'content': content, 'content_selector': content_selector}
+
+
+def parse_page_html(html_bytes: bytes) -> Dict[str, str]:
+    # Точка входа для ProcessPoolExecutor: на вход сырые байты, наружу — только три поля
+    page_fields = extract_page_fields(html_bytes)
+    return {'title': page_fields['title'], 'description': page_fields['description'],
+            'full_text': f"{page_fields['title']} {page_fields['description']} {page_fields['content']}"}
+
+
+class HeadMetaParser(HTMLParser):
+    # Потоковый разбор только <head>: на вход куски байтов по мере загрузки, после </head> или <body> — готово
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._title_parts: Optional[List[str]] = None
+        self._in_title = False
+        self.title: Optional[str] = None
+        self.description: Optional[str] = None
+        self.done = False
+
+    def feed_bytes(self, chunk: bytes) -> bool:
+        if not self.done:
+            self.feed(self._decoder.decode(chunk))
+        return self.done
+
+    def finish(self) -> Tuple[str, str]:
+        if not self.done:
+            self.feed(self._decoder.decode(b'', final=True))
+            self.close()
+        if self._title_parts is not None and self.title is None:
+            self.title = ''.join(self._title_parts)
+        return (self.title or '').strip(), (self.description or '').strip()
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if self.done: return
+        if tag == 'body':
+            self.done = True
+        elif tag == 'title' and self._title_parts is None:
+            self._title_parts = []; self._in_title = True
+        elif tag == 'meta' and self.description is None:
+            attributes = dict(attrs)
+            if attributes.get('name') == 'description':
+                self.description = attributes.get('content') or ''
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str):
+        if self.done: return
+        if tag == 'title' and self._in_title:
+            self._in_title = False; self.title = ''.join(self._title_parts)
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data: str):
+        if self._in_title: self._title_parts.append(data)
+
+
+def extract_head_meta(html_source: Union[str, bytes]) -> Tuple[str, str]:
+    head_parser = HeadMetaParser()
+    head_parser.feed_bytes(html_source.encode('utf-8') if isinstance(html_source, str) else html_source)
+    return head_parser.finish()
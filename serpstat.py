@@ -3,7 +3,8 @@ import pandas as pd
 import requests
 import io
 import re
-from collections import Counter
+from collections import Counter, OrderedDict, deque
+from itertools import islice
 import pymorphy3
 import base64
 from io import BytesIO
@@ -14,15 +15,36 @@ import urllib3
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from urllib.parse import urlparse, urljoin
-from typing import List, Dict, Tuple, Optional, Any, Set
-from bs4 import BeautifulSoup
+from typing import List, Dict, Tuple, Optional, Any, Set, FrozenSet, Union, Iterator, Iterable
 import pymorphy3
 import Stemmer
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+import math
+import bisect
 import html
 import traceback
 import asyncio
 import aiohttp
+import sqlite3
+import threading
+import time
+import zlib
+import email.utils
+import hashlib
+import multiprocessing
+import uuid
+from dataclasses import dataclass
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import json
+from concurrent.futures.process import BrokenProcessPool
+from page_parser import HeadMetaParser, extract_meta, extract_page_fields, parse_html_document, parse_page_html
+from text_normalizer import clean_meta_text, normalize_batch, normalize_for_search
+from text_similarity import SIMILARITY_MATCH_THRESHOLD, SIMILARITY_PARTIAL_THRESHOLD, batch_similarity
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
 
 # =================== НАСТРОЙКИ ===================
 load_dotenv()
@@ -40,6 +62,15 @@ AUTO_EXTEND = {
     "no-shpa": "no-shpa таблетки",
 }
 
+SERPSTAT_SE = "g_ua"
+SERPSTAT_SEARCH_TYPE = "phrase_all"
+SERPSTAT_CACHE_TTL = int(os.getenv("SERPSTAT_CACHE_TTL", str(7 * 24 * 3600)))
+SERPSTAT_REQUESTS_PER_SECOND = float(os.getenv("SERPSTAT_RPS", "1"))
+SERPSTAT_MAX_WORKERS = 4
+SERPSTAT_PAGE_SIZE = 100
+SERPSTAT_MAX_PAGES = 5
+SERPSTAT_SORT = {"region_queries_count": "desc"}
+
 RELEVANT_WORDS = [
     "проклад", "ежеднев", "ночн", "гигиен", "always", "олвейс",
     "таблет", "nurofen", "но-шпа", "libresse", "no-shpa"
@@ -63,12 +94,25 @@ DEFAULT_LSI_TRUNC_MAX_REMOVE = 3
 DEFAULT_LSI_TRUNC_MIN_ORIG_LEN = 7
 DEFAULT_LSI_TRUNC_MIN_FINAL_LEN = 4
 DEFAULT_STEM_FUZZY_RATIO_THRESHOLD = 90
+RESULTS_PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+DEFAULT_RESULTS_PAGE_SIZE = 50
+CACHE_DIR = os.getenv("SEO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".seo_cache"))
+PAGE_CACHE_DB_PATH = os.path.join(CACHE_DIR, "pages.sqlite")
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", str(7 * 24 * 3600)))
+PAGE_CACHE_MAX_PAGES = int(os.getenv("PAGE_CACHE_MAX_PAGES", "20000"))
+PAGE_CACHE_EVICT_EVERY = 500
+SERPSTAT_CACHE_DB_PATH = os.path.join(CACHE_DIR, "serpstat.sqlite")
+MORPH_CACHE_DB_PATH = os.path.join(CACHE_DIR, "morphology.sqlite")
+IMAGE_CHECK_DB_PATH = os.path.join(CACHE_DIR, "image_checks.sqlite")
+MORPH_PERSIST_ENABLED = os.getenv("MORPH_PERSIST", "1") != "0"
+MORPH_LRU_MAX_ENTRIES = 200_000
+PAGE_ANALYSIS_CACHE_MAX_ENTRIES = 4096
+CHECK_RESULTS_CACHE_MAX_ENTRIES = 16
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 RUSSIAN_STEMMER = Stemmer.Stemmer('russian')
 RAPIDFUZZ_AVAILABLE = True
-morph = pymorphy3.MorphAnalyzer()
 
 
 session = requests.Session()
@@ -85,63 +129,274 @@ def build_query(name):
             return AUTO_EXTEND[key]
     return name
 
+def is_relevant_phrase(phrase, relevant_words=RELEVANT_WORDS):
+    lp = phrase.lower()
+    word_count = len(lp.split())
+    return word_count >= 1 and any(word in lp for word in relevant_words)  # Упрощённый фильтр
+
 def filter_phrases(phrases, relevant_words=RELEVANT_WORDS, top_n=10):
     filtered = []
     for p in phrases:
-        lp = p.lower()
-        word_count = len(lp.split())
-        if word_count >= 1 and any(word in lp for word in relevant_words):  # Упрощённый фильтр
+        if is_relevant_phrase(p, relevant_words):
             filtered.append(p)
         if len(filtered) >= top_n:
             break
     return filtered[:top_n] if filtered else phrases[:top_n]  # Возвращаем хотя бы топ-N, если фильтр пуст
 
-def get_serpstat_phrases_top_filtered(keyword, top_n=10):
-    if not API_TOKEN:
-        st.error("API-токен Serpstat не настроен. Проверь файл .env.")
-        return []
-    keyword_query = build_query(keyword)
-    payload = {
-        "id": "1",
-        "method": "SerpstatKeywordProcedure.getKeywords",
-        "params": {
-            "keyword": keyword_query,
-            "se": "g_ua",
-            "type": "phrase_all",
-            "page": 1,
-            "size": 500
-        }
-    }
-    try:
-        st.write(f"Запрос к API для ключевого слова: {keyword_query}")
-        resp = requests.post(API_URL, json=payload, timeout=30)
+class TokenBucket:
+    # Ограничитель частоты запросов: rate токенов в секунду, не больше capacity подряд
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        with self._lock: self.rate = rate
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+class SerpstatClient:
+    # Клиент Serpstat API: общий HTTP-пул, дисковый кэш ответов с TTL, склейка одинаковых запросов в полёте
+    def __init__(self, api_url: Optional[str], cache_db_path: str, cache_ttl: int = SERPSTAT_CACHE_TTL,
+                 requests_per_second: float = SERPSTAT_REQUESTS_PER_SECOND):
+        self.api_url = api_url
+        self.cache_ttl = cache_ttl
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self._http = requests.Session()
+        retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=frozenset(['POST']))
+        self._http.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=SERPSTAT_MAX_WORKERS * 2, max_retries=retry))
+        os.makedirs(os.path.dirname(cache_db_path), exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (cache_key TEXT PRIMARY KEY, response TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        self._conn.commit()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def _cache_get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._conn.execute("SELECT response, fetched_at FROM responses WHERE cache_key = ?", (cache_key,)).fetchone()
+        if row and time.time() - row[1] < self.cache_ttl:
+            return json.loads(row[0])
+        return None
+
+    def _cache_put(self, cache_key: str, response: Dict[str, Any]):
+        with self._db_lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (cache_key, json.dumps(response, ensure_ascii=False), time.time()))
+            self._conn.commit()
+
+    def _post(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self.rate_limiter.acquire()
+        payload = {"id": "1", "method": "SerpstatKeywordProcedure.getKeywords", "params": params}
+        resp = self._http.post(self.api_url, json=payload, timeout=30)
         resp.raise_for_status()
-        result = resp.json()
-        st.write(f"Ответ от API: {result}")
-        if "result" in result and "data" in result["result"]:
-            data = result["result"]["data"]
-            data = [d for d in data if "keyword" in d and "region_queries_count" in d]
-            if not data:
-                st.write("API вернул пустой список данных.")
-                return []
-            data.sort(key=lambda d: int(d["region_queries_count"]), reverse=True)
-            all_phrases = [d['keyword'] for d in data]
-            filtered_phrases = filter_phrases(all_phrases, RELEVANT_WORDS, top_n)
-            st.write(f"Отфильтрованные фразы: {filtered_phrases}")
-            return filtered_phrases
-        else:
-            st.write("Нет данных в результате API.")
-            return []
-    except requests.exceptions.RequestException as e:
-        st.error(f"Ошибка подключения к API Serpstat: {str(e)}")
-        return []
-    except Exception as e:
-        st.error(f"Неожиданная ошибка при запросе к API: {str(e)}")
-        return []
+        return resp.json()
+
+    def get_keywords(self, keyword: str, se: str = SERPSTAT_SE, search_type: str = SERPSTAT_SEARCH_TYPE,
+                     size: int = 500, page: int = 1, sort: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        params = {"keyword": keyword, "se": se, "type": search_type, "page": page, "size": size}
+        if sort: params["sort"] = sort
+        cache_key = json.dumps(params, ensure_ascii=False, sort_keys=True)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        with self._inflight_lock:
+            inflight = self._inflight.get(cache_key)
+            is_owner = inflight is None
+            if is_owner:
+                inflight = self._inflight[cache_key] = Future()
+        if not is_owner:
+            return inflight.result()
+        try:
+            result = self._post(params)
+            if "result" in result:  # ошибки API не кэшируем
+                self._cache_put(cache_key, result)
+            inflight.set_result(result)
+            return result
+        except Exception as e:
+            inflight.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(cache_key, None)
+
+@st.cache_resource
+def get_serpstat_client() -> SerpstatClient:
+    return SerpstatClient(API_URL, SERPSTAT_CACHE_DB_PATH)
+
+class SerpstatApiError(Exception):
+    # JSON-RPC ответ с "error" вместо "result": закончились лимиты, неверный токен, неподдерживаемая сортировка
+    def __init__(self, error: Any):
+        self.error = error
+        if isinstance(error, dict) and "message" in error:
+            error = f"{error['message']} (код {error.get('code', '—')})"
+        super().__init__(str(error))
+
+def iter_serpstat_keyword_pages(keyword_query: str, page_size: int = SERPSTAT_PAGE_SIZE,
+                                max_pages: int = SERPSTAT_MAX_PAGES) -> Iterator[List[Dict[str, Any]]]:
+    # Страницы запрашиваются по одной, только пока потребитель итерирует генератор
+    client = get_serpstat_client()
+    for page in range(1, max_pages + 1):
+        result = client.get_keywords(keyword_query, size=page_size, page=page, sort=SERPSTAT_SORT)
+        if "error" in result:
+            raise SerpstatApiError(result["error"])
+        if "result" not in result or "data" not in result["result"]:
+            return
+        raw_data = result["result"]["data"]
+        data = [d for d in raw_data if "keyword" in d and "region_queries_count" in d]
+        data.sort(key=lambda d: int(d["region_queries_count"]), reverse=True)
+        yield data
+        if len(raw_data) < page_size:
+            return
+
+def collect_top_phrases(pages: Iterable[List[Dict[str, Any]]], top_n: int = 10) -> List[str]:
+    relevant_phrases, all_phrases = [], []
+    for data in pages:
+        for d in data:
+            all_phrases.append(d['keyword'])
+            if is_relevant_phrase(d['keyword']):
+                relevant_phrases.append(d['keyword'])
+                if len(relevant_phrases) >= top_n:
+                    return relevant_phrases
+    return relevant_phrases if relevant_phrases else all_phrases[:top_n]  # Возвращаем хотя бы топ-N, если фильтр пуст
+
+def fetch_serpstat_phrases(keyword: str, top_n: int = 10, page_size: int = SERPSTAT_PAGE_SIZE,
+                           max_pages: int = SERPSTAT_MAX_PAGES) -> List[str]:
+    # Без вывода в st.* — безопасно вызывать из рабочих потоков
+    return collect_top_phrases(iter_serpstat_keyword_pages(build_query(keyword), page_size, max_pages), top_n)
+
+# ========== МОРФОЛОГИЯ ==========
+class LRUCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data: return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_entries: self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class MorphologyService:
+    # Общий на процесс морфологический слой: LRU слово -> леммы и слово -> основа (Snowball),
+    # леммы опционально сохраняются на диск, чтобы словарь препаратов и брендов не прогревался заново
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = MORPH_LRU_MAX_ENTRIES):
+        self._analyzer = pymorphy3.MorphAnalyzer()
+        self._stemmer = Stemmer.Stemmer('russian')
+        self._lock = threading.Lock()
+        self._lemmas = LRUCache(max_entries)  # слово -> (основная лемма, все леммы)
+        self._stems = LRUCache(max_entries)
+        self._pending_lemmas: Dict[str, Tuple[str, FrozenSet[str]]] = {}
+        self._conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lemmas (word TEXT PRIMARY KEY, primary_lemma TEXT NOT NULL, all_lemmas TEXT NOT NULL)")
+            self._conn.commit()
+            for word, primary_lemma, all_lemmas in self._conn.execute("SELECT word, primary_lemma, all_lemmas FROM lemmas LIMIT ?", (max_entries,)):
+                self._lemmas.put(word, (primary_lemma, frozenset(all_lemmas.split())))
+
+    def _analyze(self, word: str) -> Tuple[str, FrozenSet[str]]:
+        parses = self._analyzer.parse(word)
+        primary_lemma = parses[0].normal_form if parses else word
+        all_lemmas = frozenset(p.normal_form for p in parses if p.normal_form.strip().isalnum())
+        if not all_lemmas and word.isalnum(): all_lemmas = frozenset([word])
+        return primary_lemma, all_lemmas
+
+    def _lemma_entry(self, word: str) -> Tuple[str, FrozenSet[str]]:
+        with self._lock:
+            entry = self._lemmas.get(word)
+            if entry is None:
+                entry = self._analyze(word)
+                self._lemmas.put(word, entry)
+                if self._conn is not None: self._pending_lemmas[word] = entry
+            return entry
+
+    def primary_lemma(self, word: str) -> str:
+        return self._lemma_entry(word.strip().lower())[0]
+
+    def lemmas(self, word: str) -> FrozenSet[str]:
+        clean_word = word.strip().lower()
+        return self._lemma_entry(clean_word)[1] if clean_word else frozenset()
+
+    def stem(self, word: str) -> Optional[str]:
+        clean_word = word.strip().lower()
+        if not clean_word: return None
+        with self._lock:
+            stem = self._stems.get(clean_word)
+            if stem is None:
+                stem = self._stemmer.stemWord(clean_word)
+                self._stems.put(clean_word, stem)
+            return stem
+
+    def resolve_lemmas_batch(self, words: Iterable[str]) -> Dict[str, Tuple[str, FrozenSet[str]]]:
+        # Каждое уникальное слово разбирается один раз, независимо от числа вхождений
+        unique_words = dict.fromkeys(words)
+        resolved = {}
+        with self._lock:
+            for word in unique_words:
+                entry = self._lemmas.get(word)
+                if entry is None:
+                    entry = self._analyze(word)
+                    self._lemmas.put(word, entry)
+                    if self._conn is not None: self._pending_lemmas[word] = entry
+                resolved[word] = entry
+        return resolved
+
+    def primary_lemmas_batch(self, words: List[str]) -> List[str]:
+        resolved = self.resolve_lemmas_batch(words)
+        return [resolved[word][0] for word in words]
+
+    def stems_batch(self, words: List[str]) -> List[str]:
+        unique_words = list(dict.fromkeys(words))
+        resolved = {}
+        with self._lock:
+            missing_words = []
+            for word in unique_words:
+                stem = self._stems.get(word)
+                if stem is None: missing_words.append(word)
+                else: resolved[word] = stem
+            for word, stem in zip(missing_words, self._stemmer.stemWords(missing_words)):
+                self._stems.put(word, stem)
+                resolved[word] = stem
+        return [resolved[word] for word in words]
+
+    def flush(self):
+        if self._conn is None: return
+        with self._lock:
+            if not self._pending_lemmas: return
+            rows = [(word, primary_lemma, ' '.join(sorted(all_lemmas))) for word, (primary_lemma, all_lemmas) in self._pending_lemmas.items()]
+            self._pending_lemmas.clear()
+            self._conn.executemany("INSERT OR REPLACE INTO lemmas VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+@st.cache_resource
+def get_morphology_service() -> MorphologyService:
+    return MorphologyService(MORPH_CACHE_DB_PATH if MORPH_PERSIST_ENABLED else None)
 
 def analyze_texts(text1: str, text2: str) -> str:
     try:
-        morph = pymorphy3.MorphAnalyzer()
+        morphology = get_morphology_service()
     except Exception as e:
         st.error(f"Ошибка при инициализации морфологического анализатора: {e}")
         return "Не удалось выполнить анализ."
@@ -150,11 +405,11 @@ def analyze_texts(text1: str, text2: str) -> str:
     text2_cleaned = re.sub(r'\s+', ' ', text2)
     def get_lemmas(text: str) -> list:
         words = re.findall(r'\b[а-яА-ЯёЁ-]+\b', text.lower())
-        lemmas = [morph.parse(word)[0].normal_form for word in words]
-        return lemmas
+        return morphology.primary_lemmas_batch(words)
 
     lemmas1_set = set(get_lemmas(text1_cleaned))
     all_lemmas_from_text2 = get_lemmas(text2_cleaned)
+    morphology.flush()
     unique_lemmas = [lemma for lemma in all_lemmas_from_text2 if lemma not in lemmas1_set]
     if not unique_lemmas:
         return "Во втором тексте не найдено уникальных слов, отсутствующих в первом."
@@ -164,48 +419,25 @@ def analyze_texts(text1: str, text2: str) -> str:
     return "\n".join(result_markdown)
 
 # ========== НОВАЯ ВКЛАДКА: SEO Meta Checker ==========
-def normalize_for_search(text: Optional[Any]) -> str:
-    if not text: return ""
-    text_str = str(text).lower()
-    text_str = re.sub(r'(цена от|ціна від|price from)\s*[^-\|\n\r<]+?(\s*[-\|]|$)', ' ', text_str, flags=re.IGNORECASE)
-    text_str = re.sub(r'%[a-z_]+price[a-z_]*%', ' ', text_str)
-    text_str = re.sub(r'%[a-z_]+%', ' ', text_str)
-    text_str = re.sub(r'\d+(\.\d+)?\s*(грн|uah|usd|eur)?', ' ', text_str)
-    text_str = re.sub(r'[/\\|\-–—]', ' ', text_str)
-    text_str = re.sub(r'[\s\u00a0\u200b]+', ' ', text_str)
-    text_str = re.sub(r'[^\w\s]', '', text_str, flags=re.UNICODE)
-    text_str = re.sub(r'\s+', ' ', text_str)
-    return text_str.strip()
-
 def split_phrases(phrases_text: Optional[Any]) -> List[str]:
     if not phrases_text or (isinstance(phrases_text, float) and pd.isna(phrases_text)) or not str(phrases_text).strip():
         return []
     phrases = re.split(r'[,\n]+', str(phrases_text))
     return [p.strip() for p in phrases if p.strip()]
 
-@st.cache_data
-def cached_lemmatize_word_flexibly(word_to_lemmatize: str, debug_mode_for_messages: bool = False) -> Set[str]:
+def cached_lemmatize_word_flexibly(word_to_lemmatize: str, debug_mode_for_messages: bool = False) -> FrozenSet[str]:
     clean_word = word_to_lemmatize.strip().lower()
-    if not clean_word: return set()
-    analyses = morph.analyze(clean_word)
-    possible_lemmas = set()
-    for analysis_item in analyses:
-        if analysis_item.get('analysis') and analysis_item['analysis']:
-            lemma = analysis_item['analysis'][0]['lex'].lower()
-            if lemma.strip().isalnum(): possible_lemmas.add(lemma)
-        elif not possible_lemmas and 'text' in analysis_item:
-            original_form = analysis_item['text'].lower()
-            if original_form.strip().isalnum(): possible_lemmas.add(original_form)
-    if debug_mode_for_messages and not possible_lemmas and clean_word:
+    if not clean_word: return frozenset()
+    possible_lemmas = get_morphology_service().lemmas(clean_word)
+    if debug_mode_for_messages and not possible_lemmas:
         if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
-        debug_msg_detail = f"Анализ Mystem: {str(analyses)[:100]}..." if analyses else "Нет анализа"
-        st.session_state.debug_messages.append(f"[LSI Word (Cached)] Слово '{clean_word}' не дало лемм. {debug_msg_detail}")
+        st.session_state.debug_messages.append(f"[LSI Word (Cached)] Слово '{clean_word}' не дало лемм.")
     return possible_lemmas
 
 def get_primary_lemmas_from_normalized_text(normalized_text: str, debug_mode: bool = False) -> Set[str]:
     if not normalized_text: return set()
-    lemmas = morph.lemmatize(normalized_text)
-    cleaned_lemmas = {token.lower() for token in lemmas if token.strip().isalnum()}
+    unique_tokens = list(dict.fromkeys(normalized_text.split()))
+    cleaned_lemmas = {lemma for lemma in get_morphology_service().primary_lemmas_batch(unique_tokens) if lemma.strip().isalnum()}
     if debug_mode:
         if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
         text_sample = normalized_text[:50] + "..." if len(normalized_text) > 50 else normalized_text
@@ -216,18 +448,111 @@ def get_primary_lemmas_from_normalized_text(normalized_text: str, debug_mode: bo
 
 def get_stem_for_word(word: str) -> Optional[str]:
     if not RUSSIAN_STEMMER or not word or not word.strip(): return None
-    return RUSSIAN_STEMMER.stemWord(word.lower().strip())
-
-def check_exact_phrases(text: str, phrases_input: Optional[Any], debug_mode: bool = False) -> Dict[str, bool]:
+    return get_morphology_service().stem(word)
+
+class FuzzyStemIndex:
+    # Индекс основ страницы по длине: fuzz.ratio >= порога возможен только при |l1 - l2| <= (1 - порог) * (l1 + l2),
+    # поэтому сравниваем лишь с корзинами подходящей длины, а лучшего кандидата ищет rapidfuzz в C
+    def __init__(self, stems: Iterable[str]):
+        self._stems_by_length: Dict[int, List[str]] = {}
+        for stem in stems:
+            self._stems_by_length.setdefault(len(stem), []).append(stem)
+
+    def __bool__(self):
+        return bool(self._stems_by_length)
+
+    def _candidate_lengths(self, query_length: int, threshold: float) -> range:
+        slack = 1 - threshold / 100
+        min_length = math.floor(query_length * (1 - slack) / (1 + slack))
+        max_length = math.ceil(query_length * (1 + slack) / (1 - slack)) if slack < 1 else max(self._stems_by_length, default=0)
+        return range(max(min_length, 0), max_length + 1)
+
+    def best_match(self, query: str, threshold: float) -> Optional[Tuple[str, float]]:
+        candidates = [stem for length in self._candidate_lengths(len(query), threshold)
+                      for stem in self._stems_by_length.get(length, ())]
+        if not candidates: return None
+        match = process.extractOne(query, candidates, scorer=fuzz.ratio, score_cutoff=threshold)
+        return (match[0], match[1]) if match else None
+
+class PrefixWordIndex:
+    # Отсортированные уникальные слова нормализованного текста: «есть ли слово с таким началом» — двоичным поиском.
+    # Среди подходящих возвращается слово, встретившееся в тексте раньше всех, как у re.search(r'\bпрефикс\w*\b')
+    def __init__(self, normalized_text: str):
+        first_positions: Dict[str, int] = {}
+        for position, word in enumerate(normalized_text.split()):
+            first_positions.setdefault(word, position)
+        self._words = sorted(first_positions)
+        self._first_positions = [first_positions[word] for word in self._words]
+
+    def first_word_with_prefix(self, prefix: str) -> Optional[str]:
+        if not prefix: return None
+        start = bisect.bisect_left(self._words, prefix)
+        end = start
+        while end < len(self._words) and self._words[end].startswith(prefix):
+            end += 1
+        if start == end: return None
+        best_index = min(range(start, end), key=self._first_positions.__getitem__)
+        return self._words[best_index]
+
+@dataclass(frozen=True)
+class PageAnalysis:
+    # Всё, что проверки фраз берут со страницы: считается один раз на (URL, язык, содержимое) и не меняется
+    normalized_text: str
+    tokens: Tuple[str, ...]
+    lemmas: FrozenSet[str]
+    stems: FrozenSet[str]
+    fuzzy_index: Optional[FuzzyStemIndex]
+    prefix_index: PrefixWordIndex
+
+def build_page_analysis(raw_page_text: str) -> PageAnalysis:
+    normalized_text = normalize_for_search(raw_page_text)
+    tokens = tuple(normalized_text.split())
+    lemmas = frozenset(get_primary_lemmas_from_normalized_text(normalized_text))
+    stems = frozenset()
+    if RUSSIAN_STEMMER and tokens:
+        stems = frozenset(stem for stem in get_morphology_service().stems_batch(list(dict.fromkeys(tokens))) if stem)
+    return PageAnalysis(normalized_text=normalized_text, tokens=tokens, lemmas=lemmas, stems=stems,
+                        fuzzy_index=FuzzyStemIndex(stems) if RAPIDFUZZ_AVAILABLE else None,
+                        prefix_index=PrefixWordIndex(normalized_text))
+
+@st.cache_resource(max_entries=PAGE_ANALYSIS_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_cached_page_analysis(url: str, lang: str, content_hash: str, _raw_page_text: str) -> PageAnalysis:
+    # Текст исключён из ключа (подчёркивание): его заменяет хэш, чтобы не хэшировать страницу на каждом rerun
+    return build_page_analysis(_raw_page_text)
+
+def get_page_analysis(url: str, lang: str, raw_page_text: str) -> PageAnalysis:
+    content_hash = hashlib.blake2b((raw_page_text or "").encode('utf-8'), digest_size=16).hexdigest()
+    return get_cached_page_analysis(url, lang, content_hash, raw_page_text or "")
+
+def find_exact_phrases(normalized_text: str, normalized_phrases: Iterable[str]) -> Set[str]:
+    # Все фразы строки ищутся за один проход автоматом Ахо-Корасик. Фразы и текст обрамлены пробелами,
+    # поэтому совпадение засчитывается только по границам слов (нормализованный текст — слова через один пробел)
+    patterns = {f" {phrase} " for phrase in normalized_phrases if phrase}
+    if not patterns or not normalized_text: return set()
+    haystack = f" {normalized_text} "
+    if not AHOCORASICK_AVAILABLE:
+        return {pattern[1:-1] for pattern in patterns if pattern in haystack}
+    automaton = ahocorasick.Automaton()
+    for pattern in patterns:
+        automaton.add_word(pattern, pattern)
+    automaton.make_automaton()
+    found_patterns = set()
+    for _, pattern in automaton.iter(haystack):
+        found_patterns.add(pattern)
+        if len(found_patterns) == len(patterns): break
+    return {pattern[1:-1] for pattern in found_patterns}
+
+def check_exact_phrases(text: str, phrases_input: Optional[Any], debug_mode: bool = False,
+                        page_analysis: Optional[PageAnalysis] = None) -> Dict[str, bool]:
     if not text or not phrases_input or (isinstance(phrases_input, float) and pd.isna(phrases_input)): return {}
-    norm_page_text_for_exact_check = normalize_for_search(text)
+    norm_page_text_for_exact_check = page_analysis.normalized_text if page_analysis is not None else normalize_for_search(text)
     phrases_list = split_phrases(phrases_input)
+    normalized_phrases = dict(zip(phrases_list, normalize_batch(phrases_list)))
+    found_phrases = find_exact_phrases(norm_page_text_for_exact_check, normalized_phrases.values())
     results = {}
     for phrase in phrases_list:
-        norm_phrase_to_find = normalize_for_search(phrase)
-        found = False
-        if norm_phrase_to_find:
-            found = norm_phrase_to_find in norm_page_text_for_exact_check
+        norm_phrase_to_find = normalized_phrases[phrase]
+        found = bool(norm_phrase_to_find) and norm_phrase_to_find in found_phrases
         if debug_mode:
             if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
             st.session_state.debug_messages.append({
@@ -238,12 +563,22 @@ def check_exact_phrases(text: str, phrases_input: Optional[Any], debug_mode: boo
         results[f"{PREFIX_EXACT_PHRASE}{phrase}"] = found
     return results
 
-def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mode: bool = False) -> Dict[str, bool]:
-    enable_truncation = st.session_state.get('enable_lsi_truncation', DEFAULT_ENABLE_LSI_TRUNCATION)
-    trunc_max_remove = st.session_state.get('lsi_trunc_max_remove', DEFAULT_LSI_TRUNC_MAX_REMOVE)
-    trunc_min_orig_len = st.session_state.get('lsi_trunc_min_orig_len', DEFAULT_LSI_TRUNC_MIN_ORIG_LEN)
-    trunc_min_final_len = st.session_state.get('lsi_trunc_min_final_len', DEFAULT_LSI_TRUNC_MIN_FINAL_LEN)
-    current_fuzzy_thresh = st.session_state.get('stem_fuzzy_ratio_threshold', DEFAULT_STEM_FUZZY_RATIO_THRESHOLD)
+def get_lsi_settings() -> Dict[str, Any]:
+    # Настройки LSI из сайдбара одним словарём: передаются в проверки явно и входят в ключ кэша результатов
+    return {'fuzzy_threshold': st.session_state.get('stem_fuzzy_ratio_threshold', DEFAULT_STEM_FUZZY_RATIO_THRESHOLD),
+            'enable_truncation': st.session_state.get('enable_lsi_truncation', DEFAULT_ENABLE_LSI_TRUNCATION),
+            'trunc_max_remove': st.session_state.get('lsi_trunc_max_remove', DEFAULT_LSI_TRUNC_MAX_REMOVE),
+            'trunc_min_orig_len': st.session_state.get('lsi_trunc_min_orig_len', DEFAULT_LSI_TRUNC_MIN_ORIG_LEN),
+            'trunc_min_final_len': st.session_state.get('lsi_trunc_min_final_len', DEFAULT_LSI_TRUNC_MIN_FINAL_LEN)}
+
+def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mode: bool = False,
+                      page_analysis: Optional[PageAnalysis] = None, lsi_settings: Optional[Dict[str, Any]] = None) -> Dict[str, bool]:
+    if lsi_settings is None: lsi_settings = get_lsi_settings()
+    enable_truncation = lsi_settings['enable_truncation']
+    trunc_max_remove = lsi_settings['trunc_max_remove']
+    trunc_min_orig_len = lsi_settings['trunc_min_orig_len']
+    trunc_min_final_len = lsi_settings['trunc_min_final_len']
+    current_fuzzy_thresh = lsi_settings['fuzzy_threshold']
 
     if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
 
@@ -256,7 +591,8 @@ def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mo
         st.session_state.debug_messages.append(raw_page_text[:300] + "...")
         st.session_state.debug_messages.append(f"(Общая длина raw_page_text: {len(raw_page_text)})")
 
-    normalized_page_content = normalize_for_search(raw_page_text)
+    if page_analysis is None: page_analysis = build_page_analysis(raw_page_text)
+    normalized_page_content = page_analysis.normalized_text
 
     if debug_mode:
         st.session_state.debug_messages.append(f"--- LSI: Текст ПОСЛЕ normalize_for_search (первые 300 симв.): ---")
@@ -267,15 +603,16 @@ def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mo
         if debug_mode: st.session_state.debug_messages.append("LSI Debug: Текст страницы стал пустым после нормализации. LSI фразы не будут найдены.")
         return {f"{PREFIX_LSI_PHRASE}{p.strip()}": False for p in split_phrases(phrases_input) if p.strip()}
 
-    page_lemmas_set = get_primary_lemmas_from_normalized_text(normalized_page_content, debug_mode)
-    page_stems_set = set()
-    if RUSSIAN_STEMMER:
-        for word_from_norm_page in normalized_page_content.split():
-            stemmed_page_word = get_stem_for_word(word_from_norm_page)
-            if stemmed_page_word: page_stems_set.add(stemmed_page_word)
-        if debug_mode:
-            if page_stems_set: st.session_state.debug_messages.append(f"[Page Stems] Найдено {len(page_stems_set)} уник. основ. Пример: {list(page_stems_set)[:10]}")
-            elif RUSSIAN_STEMMER: st.session_state.debug_messages.append("[Page Stems] Основы на странице не найдены.")
+    page_lemmas_set = page_analysis.lemmas
+    page_stems_set = page_analysis.stems
+    page_stems_index = page_analysis.fuzzy_index
+    page_prefix_index = page_analysis.prefix_index
+    if debug_mode:
+        st.session_state.debug_messages.append(f"[Page Primary Lemmas] Из норм. текста ('{normalized_page_content[:50]}{'...' if len(normalized_page_content) > 50 else ''}', {len(page_analysis.tokens)} слов) "
+                                               f"получено {len(page_lemmas_set)} уник. осн. лемм. "
+                                               f"Пример: {list(page_lemmas_set)[:10] if page_lemmas_set else 'Нет'}")
+        if page_stems_set: st.session_state.debug_messages.append(f"[Page Stems] Найдено {len(page_stems_set)} уник. основ. Пример: {list(page_stems_set)[:10]}")
+        elif RUSSIAN_STEMMER: st.session_state.debug_messages.append("[Page Stems] Основы на странице не найдены.")
 
     phrases_list = split_phrases(phrases_input)
     lsi_results = {}
@@ -299,13 +636,10 @@ def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mo
                 lsi_word_stem = get_stem_for_word(word_in_lsi_phrase)
                 if lsi_word_stem:
                     if lsi_word_stem in page_stems_set: found_this_word = True; match_type = "основа (точное совпадение)"
-                    elif not found_this_word and RAPIDFUZZ_AVAILABLE and page_stems_set:
-                        best_fuzzy_match_ratio = 0
-                        for page_stem_candidate in page_stems_set:
-                            ratio = fuzz.ratio(lsi_word_stem, page_stem_candidate)
-                            if ratio >= current_fuzzy_thresh and ratio > best_fuzzy_match_ratio:
-                                best_fuzzy_match_ratio = ratio; found_this_word = True
-                        if found_this_word: match_type = f"основа (нечеткое, схожесть {best_fuzzy_match_ratio:.0f}%)"
+                    elif not found_this_word and page_stems_index:
+                        fuzzy_match = page_stems_index.best_match(lsi_word_stem, current_fuzzy_thresh)
+                        if fuzzy_match and fuzzy_match[1] > 0:
+                            found_this_word = True; match_type = f"основа (нечеткое, схожесть {fuzzy_match[1]:.0f}%)"
             truncation_info_for_debug = None
             if not found_this_word and enable_truncation:
                 original_len = len(word_in_lsi_phrase)
@@ -314,16 +648,11 @@ def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mo
                         current_truncated_len = original_len - chars_to_remove
                         if current_truncated_len < trunc_min_final_len: break
                         truncated_lsi_word = word_in_lsi_phrase[:current_truncated_len]
-                        try:
-                            pattern = r'\b' + re.escape(truncated_lsi_word) + r'\w*\b'
-                            match_object = re.search(pattern, normalized_page_content)
-                            if match_object:
-                                found_this_word = True; matched_page_word_for_display = match_object.group(0)
-                                match_type = f"усечение до '{truncated_lsi_word}' (найдено: '{matched_page_word_for_display}')"
-                                truncation_info_for_debug = {'truncated_to': truncated_lsi_word, 'matched_on_page': matched_page_word_for_display}; break
-                        except re.error as e_re:
-                            if debug_mode: st.session_state.debug_messages.append(f"Ошибка Regex (усечение) для '{truncated_lsi_word}': {e_re}")
-                            continue
+                        matched_page_word = page_prefix_index.first_word_with_prefix(truncated_lsi_word)
+                        if matched_page_word:
+                            found_this_word = True; matched_page_word_for_display = matched_page_word
+                            match_type = f"усечение до '{truncated_lsi_word}' (найдено: '{matched_page_word_for_display}')"
+                            truncation_info_for_debug = {'truncated_to': truncated_lsi_word, 'matched_on_page': matched_page_word_for_display}; break
             if debug_mode:
                 debug_entry = {'слово_LSI_фразы': word_in_lsi_phrase, 'леммы_LSI_слова': list(possible_lemmas_for_lsi_word),
                                'основа_LSI_слова': lsi_word_stem if lsi_word_stem else (get_stem_for_word(word_in_lsi_phrase) if RUSSIAN_STEMMER else "N/A"),
@@ -337,21 +666,111 @@ def check_lsi_phrases(raw_page_text: str, phrases_input: Optional[Any], debug_mo
                                                     'details': {'оригинал_LSI_фразы': phrase, 'нормализованная_LSI_фраза': normalized_lsi_phrase,
                                                                 'целевые_слова_фразы': lsi_phrase_words, 'детали_проверки_слов': debug_lsi_word_checks,
                                                                 'итог_фраза_найдена': all_words_in_lsi_found}})
+    get_morphology_service().flush()
     return lsi_results
 
-@st.cache_data(ttl=3600)
-def get_page_data_for_lang(base_ru_url: str, lang_to_fetch: str, debug_mode_internal: bool = False,
-                           save_html_for_debug_manual: bool = False, filename_prefix_manual: str = "manual_debug_page") -> Dict[str, Any]:
-    if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'Accept-Language': 'ru-RU,ru;q=1.0,uk;q=0.8,en-US;q=0.6,en;q=0.4' if lang_to_fetch == 'ru' else 'uk-UA,uk;q=1.0,ru;q=0.8,en-US;q=0.6,en;q=0.4',
-        'Connection': 'keep-alive', 'Upgrade-Insecure-Requests': '1', 'DNT': '1', 'Sec-GPC': '1',
-    }
-    session.cookies.set('language', lang_to_fetch, domain='apteka911.ua')
-    session.cookies.set('lang', lang_to_fetch, domain='apteka911.ua')
-
+class PageCache:
+    # Дисковый кэш HTML страниц: ключ — финальный URL + язык, хранит ETag/Last-Modified для условных запросов
+    # Страницы старше ttl не отдаются и удаляются, сверх max_pages вытесняются самые давно проверенные
+    def __init__(self, db_path: str, ttl: int = PAGE_CACHE_TTL, max_pages: int = PAGE_CACHE_MAX_PAGES):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._stores_since_eviction = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # store() вызывается из event loop на каждую страницу: в WAL режим NORMAL не делает fsync на каждый commit
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+                                  final_url TEXT NOT NULL, lang TEXT NOT NULL, etag TEXT, last_modified TEXT,
+                                  html BLOB NOT NULL, fetched_at REAL NOT NULL, PRIMARY KEY (final_url, lang))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS url_aliases (
+                                  request_url TEXT NOT NULL, lang TEXT NOT NULL, final_url TEXT NOT NULL,
+                                  PRIMARY KEY (request_url, lang))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at)")
+        self._conn.commit()
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        # Вызывается под self._lock. Освобождённые страницы файла SQLite переиспользует для новых записей
+        self._conn.execute("DELETE FROM pages WHERE fetched_at < ?", (time.time() - self.ttl,))
+        overflow = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0] - self.max_pages
+        if overflow > 0:
+            self._conn.execute("DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages ORDER BY fetched_at LIMIT ?)", (overflow,))
+        self._conn.execute("""DELETE FROM url_aliases WHERE NOT EXISTS (
+                                  SELECT 1 FROM pages p WHERE p.final_url = url_aliases.final_url AND p.lang = url_aliases.lang)""")
+        self._conn.commit()
+        self._stores_since_eviction = 0
+
+    def lookup(self, request_url: str, lang: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("""SELECT p.final_url, p.etag, p.last_modified, p.html FROM url_aliases a
+                                        JOIN pages p ON p.final_url = a.final_url AND p.lang = a.lang
+                                        WHERE a.request_url = ? AND a.lang = ? AND p.fetched_at >= ?""",
+                                     (request_url, lang, time.time() - self.ttl)).fetchone()
+        if not row: return None
+        return {'final_url': row[0], 'etag': row[1], 'last_modified': row[2], 'html': zlib.decompress(row[3])}
+
+    def store(self, request_url: str, final_url: str, lang: str, html_bytes: bytes,
+              etag: Optional[str], last_modified: Optional[str]):
+        if not etag and not last_modified: return  # без валидаторов перепроверить страницу нельзя
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                               (final_url, lang, etag, last_modified, zlib.compress(html_bytes), time.time()))
+            self._conn.execute("INSERT OR REPLACE INTO url_aliases VALUES (?, ?, ?)", (request_url, lang, final_url))
+            self._conn.commit()
+            self._stores_since_eviction += 1
+            if self._stores_since_eviction >= PAGE_CACHE_EVICT_EVERY: self._evict()
+
+    def touch(self, final_url: str, lang: str):
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ? WHERE final_url = ? AND lang = ?", (time.time(), final_url, lang))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages"); self._conn.execute("DELETE FROM url_aliases")
+            self._conn.commit()
+
+@st.cache_resource
+def get_page_cache() -> PageCache:
+    return PageCache(PAGE_CACHE_DB_PATH)
+
+def build_conditional_headers(cached_page: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    if not cached_page: return {}
+    conditional_headers = {}
+    if cached_page.get('etag'): conditional_headers['If-None-Match'] = cached_page['etag']
+    if cached_page.get('last_modified'): conditional_headers['If-Modified-Since'] = cached_page['last_modified']
+    return conditional_headers
+
+PAGE_REQUEST_TIMEOUT = 20
+PAGE_FETCH_RETRY_STATUSES = (500, 502, 503, 504)
+PAGE_FETCH_MAX_RETRIES = 3
+PAGE_FETCH_BACKOFF_FACTOR = 0.5
+DEFAULT_PAGE_FETCH_CONCURRENCY = 20
+DEFAULT_PAGE_FETCH_PER_HOST = 10
+DEFAULT_PARSE_WORKERS = os.cpu_count() or 1
+META_STREAM_CHUNK_SIZE = 8192
+
+def shutdown_parse_pool(parse_pool: ProcessPoolExecutor):
+    parse_pool.shutdown(wait=False, cancel_futures=True)
+
+# Один пул на сервер: при смене числа процессов прежний вытесняется из кэша и останавливается.
+# forkserver, а не fork по умолчанию: fork из многопоточного сервера Streamlit может повесить дочерние процессы
+@st.cache_resource(max_entries=1, on_release=shutdown_parse_pool, show_spinner=False)
+def get_parse_pool(max_workers: int) -> ProcessPoolExecutor:
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload(['page_parser'])  # lxml импортируется один раз в forkserver, а не в каждом процессе
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+
+def discard_broken_parse_pool(parse_pool: ProcessPoolExecutor):
+    # Сломанный пул из кэша ресурсов не восстанавливается сам: убираем его (on_release остановит), следующая загрузка создаст новый
+    get_parse_pool.clear()
+    st.session_state.parse_pool_broken = True
+
+def build_lang_url(base_ru_url: str, lang_to_fetch: str) -> str:
     parsed_original_url = urlparse(base_ru_url)
     original_path = parsed_original_url.path.lstrip('/')
     original_query = parsed_original_url.query
@@ -372,115 +791,305 @@ def get_page_data_for_lang(base_ru_url: str, lang_to_fetch: str, debug_mode_inte
             modified_url_with_query = f"{base_modified_url}?{original_query}"
         else:
             modified_url_with_query = f"{base_modified_url}{original_query}"
+    return modified_url_with_query
+
+def build_page_headers(lang_to_fetch: str) -> Dict[str, str]:
+    return {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+        'Accept-Language': 'ru-RU,ru;q=1.0,uk;q=0.8,en-US;q=0.6,en;q=0.4' if lang_to_fetch == 'ru' else 'uk-UA,uk;q=1.0,ru;q=0.8,en-US;q=0.6,en;q=0.4',
+        'Connection': 'keep-alive', 'Upgrade-Insecure-Requests': '1', 'DNT': '1', 'Sec-GPC': '1',
+    }
+
+def save_page_html_for_debug(html_content: str, final_url: str, lang_to_fetch: str, filename_prefix: str, debug_mode: bool = False):
+    try:
+        path_part = "".join(c if c.isalnum() else "_" for c in urlparse(final_url).path)
+        safe_path_part = path_part.replace("__", "_")[:50]
+        debug_html_filename = f"{filename_prefix}_{lang_to_fetch}_{safe_path_part}.html"
+        with open(debug_html_filename, "w", encoding="utf-8") as f: f.write(html_content)
+        if debug_mode: st.session_state.debug_messages.append(f"ОТЛАДКА (ручная): HTML для {final_url} сохранен в: {debug_html_filename}")
+    except Exception as e_save:
+        if debug_mode: st.session_state.debug_messages.append(f"ОШИБКА РУЧНОГО СОХРАНЕНИЯ HTML: {str(e_save)}")
+
+def parse_page_content(html_content: Union[str, bytes], final_url_after_redirects: str, debug_mode_internal: bool = False) -> Tuple[str, str, str]:
+    page_fields = extract_page_fields(html_content)
+    page_title, page_desc, content = page_fields['title'], page_fields['description'], page_fields['content']
+
+    if debug_mode_internal:
+        st.session_state.debug_messages.append(f"[META EXTRACTED] Из URL: '{final_url_after_redirects}', Title Found: {'Да' if page_title else 'Нет'}, Title: '{page_title[:150]}...'")
+        st.session_state.debug_messages.append(f"[META EXTRACTED] Из URL: '{final_url_after_redirects}', Desc Found: {'Да' if page_desc else 'Нет'}, Desc: '{page_desc[:150]}...'")
+        if page_fields['content_selector']: st.session_state.debug_messages.append(f"[CONTENT AREA] Найден по селектору: '{page_fields['content_selector']}' для URL {final_url_after_redirects}")
+        else: st.session_state.debug_messages.append(f"[CONTENT AREA] Основной блок не найден для {final_url_after_redirects}, используется весь документ.")
+        st.session_state.debug_messages.append(f"[CONTENT SAMPLE for {final_url_after_redirects}] '{content[:300]}...' (Всего символов: {len(content)})")
+    return page_title, page_desc, f"{page_title} {page_desc} {content}"
+
+async def read_head_meta_async(response: aiohttp.ClientResponse) -> Tuple[str, str, int]:
+    # Режим «только мета»: тело читается кусками до </head> (или <body>), остаток страницы не скачивается
+    head_parser = HeadMetaParser()
+    bytes_read = 0
+    async for chunk in response.content.iter_chunked(META_STREAM_CHUNK_SIZE):
+        bytes_read += len(chunk)
+        if head_parser.feed_bytes(chunk): break
+    page_title, page_desc = head_parser.finish()
+    return page_title, page_desc, bytes_read
+
+@st.cache_data(ttl=3600)
+def get_page_data_for_lang(base_ru_url: str, lang_to_fetch: str, debug_mode_internal: bool = False,
+                           save_html_for_debug_manual: bool = False, filename_prefix_manual: str = "manual_debug_page") -> Dict[str, Any]:
+    if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
+    headers = build_page_headers(lang_to_fetch)
+    session.cookies.set('language', lang_to_fetch, domain='apteka911.ua')
+    session.cookies.set('lang', lang_to_fetch, domain='apteka911.ua')
+
+    modified_url_with_query = build_lang_url(base_ru_url, lang_to_fetch)
 
     if debug_mode_internal:
         st.session_state.debug_messages.append(f"--- Отладка для URL: {base_ru_url} (язык: {lang_to_fetch}) ---")
         st.session_state.debug_messages.append(f"Исходный URL (base): '{base_ru_url}'")
-        st.session_state.debug_messages.append(f"Определен базовый путь: '{base_path}'")
         st.session_state.debug_messages.append(f"Собран финальный URL для запроса: '{modified_url_with_query}'")
 
-    page_title, page_desc, page_full_text, error_message = "", "", "", None
     final_url_after_redirects = modified_url_with_query
+    page_cache = get_page_cache()
+    cached_page = page_cache.lookup(modified_url_with_query, lang_to_fetch)
+    url_to_request = cached_page['final_url'] if cached_page else modified_url_with_query
 
     try:
-        response = session.get(modified_url_with_query, headers=headers, timeout=20, verify=False, allow_redirects=True)
-        response.raise_for_status()
-        final_url_after_redirects = response.url
+        response = session.get(url_to_request, headers={**headers, **build_conditional_headers(cached_page)},
+                               timeout=PAGE_REQUEST_TIMEOUT, verify=False, allow_redirects=True)
+        if response.status_code == 304 and cached_page:
+            final_url_after_redirects = cached_page['final_url']
+            page_cache.touch(final_url_after_redirects, lang_to_fetch)
+            raw_body = cached_page['html']
+        else:
+            response.raise_for_status()
+            final_url_after_redirects = response.url
+            raw_body = response.content
+            page_cache.store(modified_url_with_query, final_url_after_redirects, lang_to_fetch, raw_body,
+                             response.headers.get('ETag'), response.headers.get('Last-Modified'))
         if debug_mode_internal: st.session_state.debug_messages.append(f"[HTTP RESPONSE] Final URL: '{final_url_after_redirects}', Status: {response.status_code}, Apparent Encoding: {response.apparent_encoding}")
 
-        response.encoding = 'utf-8'
-        html_content = response.text
+        html_content = raw_body.decode('utf-8', errors='replace')
 
         if save_html_for_debug_manual:
-            try:
-                path_part = "".join(c if c.isalnum() else "_" for c in urlparse(final_url_after_redirects).path)
-                safe_path_part = path_part.replace("__", "_")[:50]
-                debug_html_filename = f"{filename_prefix_manual}_{lang_to_fetch}_{safe_path_part}.html"
-                with open(debug_html_filename, "w", encoding="utf-8") as f: f.write(html_content)
-                if debug_mode_internal: st.session_state.debug_messages.append(f"ОТЛАДКА (ручная): HTML для {final_url_after_redirects} сохранен в: {debug_html_filename}")
-            except Exception as e_save:
-                if debug_mode_internal: st.session_state.debug_messages.append(f"ОШИБКА РУЧНОГО СОХРАНЕНИЯ HTML: {str(e_save)}")
+            save_page_html_for_debug(html_content, final_url_after_redirects, lang_to_fetch, filename_prefix_manual, debug_mode_internal)
 
     except requests.exceptions.RequestException as e:
         error_message = f"Ошибка запроса к {modified_url_with_query}: {str(e)}"
         if debug_mode_internal: st.session_state.debug_messages.append(f"[REQUEST ERROR] URL: {modified_url_with_query}, Error: {error_message}")
         return {'title': '', 'description': '', 'full_text': '', 'error': error_message, 'final_url_fetched': modified_url_with_query}
 
-    soup = BeautifulSoup(html_content, 'html.parser')
-    title_tag = soup.find('title')
-    description_tag = soup.find('meta', attrs={'name': 'description'})
-    page_title = title_tag.text.strip() if title_tag else ''
-    page_desc = description_tag['content'].strip() if description_tag and description_tag.get('content') else ''
+    page_title, page_desc, page_full_text = parse_page_content(html_content, final_url_after_redirects, debug_mode_internal)
+    return {'title': page_title, 'description': page_desc, 'full_text': page_full_text, 'error': None, 'final_url_fetched': final_url_after_redirects}
 
+async def fetch_page_meta_for_lang_async(http_session: aiohttp.ClientSession, modified_url_with_query: str, lang_to_fetch: str,
+                                         headers: Dict[str, str], cookies: Dict[str, str], debug_mode_internal: bool = False) -> Dict[str, Any]:
+    # Частичный HTML не кладём в дисковый кэш страниц: там хранятся только полные страницы
+    error_message = None
+    for attempt in range(PAGE_FETCH_MAX_RETRIES + 1):
+        retry_delay = PAGE_FETCH_BACKOFF_FACTOR * (2 ** attempt)
+        try:
+            async with http_session.get(modified_url_with_query, headers=headers, cookies=cookies, ssl=False, allow_redirects=True,
+                                        timeout=aiohttp.ClientTimeout(total=PAGE_REQUEST_TIMEOUT)) as response:
+                if response.status in PAGE_FETCH_RETRY_STATUSES and attempt < PAGE_FETCH_MAX_RETRIES:
+                    await asyncio.sleep(retry_delay); continue
+                if response.status >= 400:
+                    error_message = f"Ошибка запроса к {modified_url_with_query}: {response.status} {response.reason} for url: {response.url}"
+                    break
+                final_url_after_redirects = str(response.url)
+                page_title, page_desc, bytes_read = await read_head_meta_async(response)
+                error_message = None
+                break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_message = f"Ошибка запроса к {modified_url_with_query}: {str(e) or type(e).__name__}"
+            if attempt < PAGE_FETCH_MAX_RETRIES: await asyncio.sleep(retry_delay)
+        except Exception as e:
+            # Не сетевой сбой (битая кодировка, некорректный редирект): повтор не поможет, а исключение оборвало бы всю загрузку
+            error_message = f"Ошибка запроса к {modified_url_with_query}: {type(e).__name__}: {e}"
+            break
+    if error_message:
+        if debug_mode_internal: st.session_state.debug_messages.append(f"[REQUEST ERROR] URL: {modified_url_with_query}, Error: {error_message}")
+        return {'title': '', 'description': '', 'full_text': '', 'error': error_message, 'final_url_fetched': modified_url_with_query}
     if debug_mode_internal:
-        st.session_state.debug_messages.append(f"[META EXTRACTED] Из URL: '{final_url_after_redirects}', Title Found: {'Да' if page_title else 'Нет'}, Title: '{page_title[:150]}...'")
-        st.session_state.debug_messages.append(f"[META EXTRACTED] Из URL: '{final_url_after_redirects}', Desc Found: {'Да' if page_desc else 'Нет'}, Desc: '{page_desc[:150]}...'")
+        st.session_state.debug_messages.append(f"[META ONLY] Final URL: '{final_url_after_redirects}', прочитано байт: {bytes_read}")
+    return {'title': page_title, 'description': page_desc, 'full_text': '', 'error': None, 'final_url_fetched': final_url_after_redirects}
+
+async def fetch_page_for_lang_async(http_session: aiohttp.ClientSession, base_ru_url: str, lang_to_fetch: str,
+                                    debug_mode_internal: bool = False, save_html_for_debug_manual: bool = False,
+                                    filename_prefix_manual: str = "manual_debug_page",
+                                    parse_pool: Optional[ProcessPoolExecutor] = None, meta_only: bool = False) -> Dict[str, Any]:
+    # Асинхронный аналог get_page_data_for_lang: та же сборка URL, заголовки и формат результата
+    headers = build_page_headers(lang_to_fetch)
+    cookies = {'language': lang_to_fetch, 'lang': lang_to_fetch}
+    modified_url_with_query = build_lang_url(base_ru_url, lang_to_fetch)
+    if debug_mode_internal:
+        st.session_state.debug_messages.append(f"--- Отладка для URL: {base_ru_url} (язык: {lang_to_fetch}) ---")
+        st.session_state.debug_messages.append(f"Собран финальный URL для запроса: '{modified_url_with_query}'")
+    if meta_only:
+        return await fetch_page_meta_for_lang_async(http_session, modified_url_with_query, lang_to_fetch, headers, cookies, debug_mode_internal)
 
-    content_parts = []
-    main_content_selectors = ['article', 'main', '.main-content', '.content', '.post-content', '.entry-content', '#content', '.b-content__body', '.js-mediator-article', '.product-description', '.page-content']
-    content_area = None
-    for selector in main_content_selectors:
-        if selector.startswith('.'): content_area = soup.find(class_=selector[1:])
-        elif selector.startswith('#'): content_area = soup.find(id=selector[1:])
-        else: content_area = soup.find(selector)
-        if content_area:
-            if debug_mode_internal and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"[CONTENT AREA] Найден по селектору: '{selector}' для URL {final_url_after_redirects}")
+    page_cache = get_page_cache()
+    cached_page = page_cache.lookup(modified_url_with_query, lang_to_fetch)
+    url_to_request = cached_page['final_url'] if cached_page else modified_url_with_query
+    headers.update(build_conditional_headers(cached_page))
+
+    error_message = None
+    for attempt in range(PAGE_FETCH_MAX_RETRIES + 1):
+        retry_delay = PAGE_FETCH_BACKOFF_FACTOR * (2 ** attempt)
+        try:
+            async with http_session.get(url_to_request, headers=headers, cookies=cookies, ssl=False, allow_redirects=True,
+                                        timeout=aiohttp.ClientTimeout(total=PAGE_REQUEST_TIMEOUT)) as response:
+                if response.status in PAGE_FETCH_RETRY_STATUSES and attempt < PAGE_FETCH_MAX_RETRIES:
+                    await asyncio.sleep(retry_delay); continue
+                if response.status == 304 and cached_page:
+                    final_url_after_redirects = cached_page['final_url']
+                    page_cache.touch(final_url_after_redirects, lang_to_fetch)
+                    raw_body = cached_page['html']
+                    error_message = None
+                    break
+                if response.status >= 400:
+                    error_message = f"Ошибка запроса к {modified_url_with_query}: {response.status} {response.reason} for url: {response.url}"
+                    break
+                final_url_after_redirects = str(response.url)
+                raw_body = await response.read()
+                page_cache.store(modified_url_with_query, final_url_after_redirects, lang_to_fetch, raw_body,
+                                 response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                error_message = None
+                break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_message = f"Ошибка запроса к {modified_url_with_query}: {str(e) or type(e).__name__}"
+            if attempt < PAGE_FETCH_MAX_RETRIES: await asyncio.sleep(retry_delay)
+        except Exception as e:
+            # Не сетевой сбой (битая кодировка, некорректный редирект): повтор не поможет, а исключение оборвало бы всю загрузку
+            error_message = f"Ошибка запроса к {modified_url_with_query}: {type(e).__name__}: {e}"
             break
-    if not content_area and debug_mode_internal and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"[CONTENT AREA] Основной блок не найден для {final_url_after_redirects}, используется весь 'soup'.")
-
-    source_tags_container = content_area if content_area else soup
-    source_tags = source_tags_container.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'span', 'td', 'th', 'strong', 'em', 'b', 'i', 'div'])
-    noisy_classes = ['advert', 'social', 'comment', 'sidebar', 'menu', 'nav', 'footer', 'header', 'modal', 'popup', 'banner', 'widget', 'related-posts', 'author-bio', 'breadcrumb', 'pagination', 'meta', 'hidden', 'sr-only', 'price', 'tools', 'actions', 'rating', 'tags', 'share', 'author', 'date', 'category', 'edit-link', 'reply', 'navigation', 'top-link', 'skip-link', 'visually-hidden', 'cookie', 'alert', 'dropdown', 'tab']
-    noisy_ids = ['comments', 'sidebar', 'navigation', 'footer', 'header', 'modal', 'popup', 'respond', 'author-info', 'related', 'sharing', 'secondary', 'primary-menu', 'top-bar', 'cookie-banner', 'gdpr-consent']
-    noisy_tags_in_parents = ['script', 'style', 'nav', 'footer', 'aside', 'header', 'form', 'button', 'select', 'textarea', 'iframe', 'noscript', 'svg', 'figure', 'figcaption', 'address']
-    for tag in source_tags:
-        is_noisy = False
-        if tag.name == 'div' and not tag.find(['p','li','span','h1','h2','h3','h4','h5','h6'], recursive=False) and len(tag.get_text(strip=True)) < 50: is_noisy = True
-        if not is_noisy and tag.has_attr('class') and any(cls in noisy_classes for cls in tag.get('class', [])): is_noisy = True
-        if not is_noisy and tag.has_attr('id') and any(id_val in noisy_ids for id_val in tag.get('id', [])): is_noisy = True
-        if not is_noisy:
-            for parent in tag.parents:
-                if parent.name in noisy_tags_in_parents: is_noisy = True; break
-                if parent.has_attr('class') and any(cls in noisy_classes for cls in parent.get('class', [])): is_noisy = True; break
-                if parent.has_attr('id') and any(id_val in noisy_ids for id_val in parent.get('id', [])): is_noisy = True; break
-        if not is_noisy:
-            tag_text = tag.get_text(separator=' ', strip=True)
-            if tag.name in ['span','div'] and len(tag_text.split()) < 3 and not any(c.isdigit() for c in tag_text):
-                if len(tag_text) < 15: continue
-            if tag_text: content_parts.append(tag_text)
-    content = ' '.join(filter(None, content_parts))
-    if debug_mode_internal and 'debug_messages' in st.session_state:
-        st.session_state.debug_messages.append(f"[CONTENT SAMPLE for {final_url_after_redirects}] '{content[:300]}...' (Всего символов: {len(content)})")
-    page_full_text = f"{page_title} {page_desc} {content}"
-    return {'title': page_title, 'description': page_desc, 'full_text': page_full_text, 'error': error_message, 'final_url_fetched': final_url_after_redirects}
-
-@st.cache_data
-def load_all_pages_data_for_both_langs(dataframe: pd.DataFrame, _debug_mode_global: bool) -> Dict[str, Dict[str, Dict[str, Any]]]:
-    all_data = {}
-    total_rows = len(dataframe)
-    if 'global_progress_text' not in st.session_state: st.session_state.global_progress_text = ""
-    if 'global_progress_value' not in st.session_state: st.session_state.global_progress_value = 0.0
-    for i, row in dataframe.iterrows():
-        base_ru_url = str(row[COL_URL_RU_EXCEL])
-        all_data[base_ru_url] = {}
-        for lang_idx, lang_code in enumerate(['ru', 'ua']):
-            current_op_total = (i * 2) + (lang_idx + 1)
-            total_ops_overall = total_rows * 2
-            st.session_state.global_progress_text = f"Загрузка: {current_op_total}/{total_ops_overall} ({base_ru_url} - {lang_code.upper()})"
-            st.session_state.global_progress_value = current_op_total / total_ops_overall
-            if _debug_mode_global: print(st.session_state.global_progress_text)
-            manual_debug_url_val = st.session_state.get("manual_debug_url_val", None)
-            manual_debug_lang_val = st.session_state.get("manual_debug_lang_val", None)
-            save_html_this_iteration = _debug_mode_global and base_ru_url == manual_debug_url_val and lang_code == manual_debug_lang_val
-            all_data[base_ru_url][lang_code] = get_page_data_for_lang(base_ru_url, lang_code,
-                                                                      debug_mode_internal=_debug_mode_global,
-                                                                      save_html_for_debug_manual=save_html_this_iteration,
-                                                                      filename_prefix_manual="auto_save_on_load")
+
+    if error_message:
+        if debug_mode_internal: st.session_state.debug_messages.append(f"[REQUEST ERROR] URL: {modified_url_with_query}, Error: {error_message}")
+        return {'title': '', 'description': '', 'full_text': '', 'error': error_message, 'final_url_fetched': modified_url_with_query}
+
+    if debug_mode_internal: st.session_state.debug_messages.append(f"[HTTP RESPONSE] Final URL: '{final_url_after_redirects}', Status: {response.status}")
+    if save_html_for_debug_manual:
+        save_page_html_for_debug(raw_body.decode('utf-8', errors='replace'), final_url_after_redirects, lang_to_fetch, filename_prefix_manual, debug_mode_internal)
+    if parse_pool is not None and not debug_mode_internal:
+        # Разбор HTML — CPU-bound, выносим в пул процессов, сеть продолжает работать в event loop
+        try:
+            parsed_page = await asyncio.get_running_loop().run_in_executor(parse_pool, parse_page_html, raw_body)
+            return {**parsed_page, 'error': None, 'final_url_fetched': final_url_after_redirects}
+        except BrokenProcessPool:
+            discard_broken_parse_pool(parse_pool)
+    page_title, page_desc, page_full_text = parse_page_content(raw_body, final_url_after_redirects, debug_mode_internal)
+    return {'title': page_title, 'description': page_desc, 'full_text': page_full_text, 'error': None, 'final_url_fetched': final_url_after_redirects}
+
+async def load_all_pages_async(base_urls: List[str], debug_mode: bool, max_concurrent: int, per_host_limit: int,
+                               progress_callback=None, parse_pool: Optional[ProcessPoolExecutor] = None,
+                               meta_only: bool = False) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    all_data = {base_ru_url: {} for base_ru_url in base_urls}
+    jobs = [(base_ru_url, lang_code) for base_ru_url in all_data for lang_code in ['ru', 'ua']]
+    manual_debug_url_val = st.session_state.get("manual_debug_url_val", None)
+    manual_debug_lang_val = st.session_state.get("manual_debug_lang_val", None)
+
+    async def run_job(base_ru_url: str, lang_code: str):
+        save_html_this_job = debug_mode and base_ru_url == manual_debug_url_val and lang_code == manual_debug_lang_val
+        page_data = await fetch_page_for_lang_async(http_session, base_ru_url, lang_code,
+                                                    debug_mode_internal=debug_mode,
+                                                    save_html_for_debug_manual=save_html_this_job,
+                                                    filename_prefix_manual="auto_save_on_load",
+                                                    parse_pool=parse_pool, meta_only=meta_only)
+        return base_ru_url, lang_code, page_data
+
+    connector = aiohttp.TCPConnector(limit=max_concurrent, limit_per_host=per_host_limit, ssl=False)
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar()) as http_session:
+        tasks = [asyncio.ensure_future(run_job(base_ru_url, lang_code)) for base_ru_url, lang_code in jobs]
+        for done_count, future in enumerate(asyncio.as_completed(tasks), start=1):
+            base_ru_url, lang_code, page_data = await future
+            all_data[base_ru_url][lang_code] = page_data
+            if progress_callback: progress_callback(done_count, len(jobs), base_ru_url, lang_code)
+    # Порядок языков внутри URL как в последовательной версии
+    return {base_ru_url: {lang_code: lang_data[lang_code] for lang_code in ['ru', 'ua']} for base_ru_url, lang_data in all_data.items()}
+
+# Без st.cache_data: функция ведёт живой прогресс в элементах страницы, а такие записи кэш не может воспроизвести.
+# Повторная загрузка того же файла всё равно дешёвая — страницы перепроверяются через дисковый PageCache
+def load_all_pages_data_for_both_langs(dataframe: pd.DataFrame, _debug_mode_global: bool,
+                                       max_concurrent: int = DEFAULT_PAGE_FETCH_CONCURRENCY,
+                                       per_host_limit: int = DEFAULT_PAGE_FETCH_PER_HOST,
+                                       parse_workers: int = DEFAULT_PARSE_WORKERS,
+                                       progress_callback=None, meta_only: bool = False) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    if 'debug_messages' not in st.session_state: st.session_state.debug_messages = []
+    base_urls = [str(url) for url in dataframe[COL_URL_RU_EXCEL].tolist()]
+    total_ops_overall = len(set(base_urls)) * 2
+    st.session_state.global_progress_text = ""
+    st.session_state.global_progress_value = 0.0
+
+    def report_progress(done_count: int, total_count: int, base_ru_url: str, lang_code: str):
+        st.session_state.global_progress_text = f"Загрузка: {done_count}/{total_ops_overall} ({base_ru_url} - {lang_code.upper()})"
+        st.session_state.global_progress_value = done_count / total_ops_overall
+        if _debug_mode_global: print(st.session_state.global_progress_text)
+        if progress_callback: progress_callback(st.session_state.global_progress_value, st.session_state.global_progress_text)
+
+    parse_pool = get_parse_pool(parse_workers) if parse_workers > 1 and not meta_only else None
+    st.session_state.parse_pool_broken = False
+    all_data = asyncio.run(load_all_pages_async(base_urls, _debug_mode_global, max_concurrent, per_host_limit, report_progress, parse_pool, meta_only))
+    if st.session_state.parse_pool_broken:
+        st.warning("Пул процессов для разбора HTML аварийно завершился: часть страниц разобрана в основном процессе. "
+                   "При следующей загрузке пул будет создан заново.")
     st.session_state.global_progress_text = "Загрузка данных завершена!"
     st.session_state.global_progress_value = 1.0
     if _debug_mode_global: print(st.session_state.global_progress_text)
     return all_data
 
+# --- ЗАГРУЗКА МЕТА-ТЕГОВ (вкладка Tittle_Description +) ---
+META_REQUEST_TIMEOUT = 10
+META_USER_AGENT = 'Mozilla/5.0'
+DEFAULT_META_FETCH_CONCURRENCY = 20
+DEFAULT_META_FETCH_PER_HOST = 10
+
+def build_meta_ua_url(url: str) -> str:
+    return url.replace("apteka911.ua/", "apteka911.ua/ua/")
+
+async def fetch_meta_async(http_session: aiohttp.ClientSession, url: str, head_only: bool = True) -> Dict[str, Any]:
+    # Ошибки не глушатся: текст ошибки и время запроса попадают в результат
+    started_at = time.perf_counter()
+    error_message = None
+    page_title, page_desc = '', ''
+    try:
+        async with http_session.get(url, headers={'User-Agent': META_USER_AGENT}, ssl=False, allow_redirects=True,
+                                    timeout=aiohttp.ClientTimeout(total=META_REQUEST_TIMEOUT)) as response:
+            if response.status >= 400: error_message = f"HTTP {response.status} {response.reason}"
+            if head_only:
+                page_title, page_desc, _ = await read_head_meta_async(response)
+            else:
+                root = parse_html_document(await response.read())
+                if root is not None: page_title, page_desc = extract_meta(root)
+    except asyncio.TimeoutError:
+        error_message = f"Таймаут {META_REQUEST_TIMEOUT} с"
+    except (aiohttp.ClientError, ValueError) as e:
+        error_message = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        # Сбой одного URL (битая кодировка, некорректный редирект) не должен обрывать gather по всем остальным
+        error_message = f"Непредвиденная ошибка {type(e).__name__}: {e}"
+    return {'title': page_title, 'description': page_desc, 'error': error_message,
+            'elapsed': round(time.perf_counter() - started_at, 3)}
+
+async def load_meta_for_urls_async(urls: List[str], max_concurrent: int, per_host_limit: int,
+                                   progress_callback=None, head_only: bool = True) -> Dict[str, Dict[str, Any]]:
+    unique_urls = list(dict.fromkeys(urls))
+    meta_by_url = {}
+    connector = aiohttp.TCPConnector(limit=max_concurrent, limit_per_host=per_host_limit, ssl=False)
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar()) as http_session:
+        async def run_job(url: str):
+            return url, await fetch_meta_async(http_session, url, head_only)
+        tasks = [asyncio.ensure_future(run_job(url)) for url in unique_urls]
+        for done_count, future in enumerate(asyncio.as_completed(tasks), start=1):
+            url, page_meta = await future
+            meta_by_url[url] = page_meta
+            if progress_callback: progress_callback(done_count, len(unique_urls), url)
+    return meta_by_url
+
+def load_meta_for_urls(urls: List[str], max_concurrent: int = DEFAULT_META_FETCH_CONCURRENCY,
+                       per_host_limit: int = DEFAULT_META_FETCH_PER_HOST, progress_callback=None,
+                       head_only: bool = True) -> Dict[str, Dict[str, Any]]:
+    return asyncio.run(load_meta_for_urls_async(urls, max_concurrent, per_host_limit, progress_callback, head_only))
+
 def display_debug_messages():
     if 'debug_messages' in st.session_state and st.session_state.debug_messages:
         st.sidebar.markdown("--- Отладочные сообщения ---")
@@ -505,9 +1114,11 @@ def display_debug_messages():
         st.session_state.debug_messages = []
         st.rerun()
 
-def run_checks_for_language(lang_to_check: str, df_excel: pd.DataFrame,
-                            all_site_data: Dict[str, Dict[str, Dict[str, Any]]],
-                            debug_mode: bool):
+@st.cache_data(show_spinner=False, max_entries=CHECK_RESULTS_CACHE_MAX_ENTRIES)
+def read_uploaded_excel(file_hash: str, _file_bytes: bytes) -> pd.DataFrame:
+    return pd.read_excel(io.BytesIO(_file_bytes))
+
+def resolve_language_columns(lang_to_check: str, df_excel: pd.DataFrame, debug_mode: bool) -> Dict[str, str]:
     if lang_to_check == 'ua':
         expected_title_col = COL_TITLE_UA_EXCEL; expected_desc_col = COL_DESC_UA_EXCEL
         exact_phrases_col = COL_EXACT_PHRASES_UA_EXCEL; lsi_col = COL_LSI_UA_EXCEL
@@ -520,6 +1131,131 @@ def run_checks_for_language(lang_to_check: str, df_excel: pd.DataFrame,
     else:
         expected_title_col = COL_TITLE_RU_EXCEL; expected_desc_col = COL_DESC_RU_EXCEL
         exact_phrases_col = COL_EXACT_PHRASES_RU_EXCEL; lsi_col = COL_LSI_RU_EXCEL
+    return {'title': expected_title_col, 'desc': expected_desc_col, 'exact': exact_phrases_col, 'lsi': lsi_col}
+
+def build_meta_check_results(df_excel: pd.DataFrame, all_site_data: Dict[str, Dict[str, Dict[str, Any]]], lang_to_check: str,
+                             expected_title_col: str, expected_desc_col: str) -> Tuple[Dict[str, int], pd.DataFrame]:
+    # Колоночный расчёт: данные страниц присоединяются к таблице, нормализация — пакетом по уникальным значениям
+    # map(str), а не astype(str): в pandas 3 astype(str) оставляет NaN. На пустом листе map сохраняет исходный dtype
+    # (например float64), поэтому результат явно приводится к object, иначе .str недоступен
+    base_urls = df_excel[COL_URL_RU_EXCEL].map(str).astype(object)
+    pages_by_url = {base_url: all_site_data.get(base_url, {}).get(lang_to_check, {}) for base_url in base_urls.unique()}
+    pages_df = pd.DataFrame.from_dict(
+        {base_url: {'final_url': page.get('final_url_fetched', base_url), 'error': page.get('error') or '',
+                    'site_title': (page.get('title') or '').strip(), 'site_desc': (page.get('description') or '').strip()}
+         for base_url, page in pages_by_url.items()}, orient='index', columns=['final_url', 'error', 'site_title', 'site_desc'])
+    meta_df = pd.DataFrame({'url': base_urls.to_numpy(),
+                            'expected_title': df_excel[expected_title_col].map(str).astype(object).str.strip().to_numpy(),
+                            'expected_desc': df_excel[expected_desc_col].map(str).astype(object).str.strip().to_numpy()})
+    meta_df = meta_df.join(pages_df, on='url')
+    has_error = meta_df['error'] != ''
+    title_match = normalize_batch(meta_df['site_title']) == normalize_batch(meta_df['expected_title'])
+    desc_match = normalize_batch(meta_df['site_desc']) == normalize_batch(meta_df['expected_desc'])
+    meta_df['title_match'] = title_match.where(meta_df['expected_title'] != '', meta_df['site_title'] == '') & ~has_error
+    meta_df['desc_match'] = desc_match.where(meta_df['expected_desc'] != '', meta_df['site_desc'] == '') & ~has_error
+    meta_df['has_issue'] = has_error | ~meta_df['title_match'] | ~meta_df['desc_match']
+    tab1_errors_summary = {'load_error': int(has_error.sum()),
+                           'title_mismatch': int((~has_error & ~meta_df['title_match']).sum()),
+                           'desc_mismatch': int((~has_error & ~meta_df['desc_match']).sum())}
+    return tab1_errors_summary, meta_df
+
+def describe_meta_issues(item_m: Dict[str, Any]) -> List[str]:
+    if item_m['error']: return [f"Ошибка загрузки: {item_m['error']}"]
+    issue_details = []
+    if not item_m['title_match']: issue_details.append('Title не совпадает')
+    if not item_m['desc_match']: issue_details.append('Desc не совпадает')
+    return issue_details
+
+@st.cache_data(show_spinner=False, max_entries=CHECK_RESULTS_CACHE_MAX_ENTRIES)
+def get_meta_check_results(file_hash: str, lang_to_check: str, load_token: str, expected_title_col: str, expected_desc_col: str,
+                           _df_excel: pd.DataFrame, _all_site_data: Dict[str, Dict[str, Dict[str, Any]]]) -> Tuple[Dict[str, int], pd.DataFrame]:
+    # Ключ — хэш файла, язык и уникальный токен загрузки страниц (кэш общий для всех сессий); сами таблицы не хэшируются
+    return build_meta_check_results(_df_excel, _all_site_data, lang_to_check, expected_title_col, expected_desc_col)
+
+def build_phrase_check_results(df_excel: pd.DataFrame, all_site_data: Dict[str, Dict[str, Dict[str, Any]]], lang_to_check: str,
+                               exact_phrases_col: str, lsi_col: str, lsi_settings: Dict[str, Any], debug_mode: bool = False,
+                               progress_callback=None) -> pd.DataFrame:
+    exact_col_exists = exact_phrases_col in df_excel.columns
+    lsi_col_exists = lsi_col in df_excel.columns
+    if not exact_col_exists and debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"ПРЕДУПРЕЖДЕНИЕ ({lang_to_check.upper()}): Кол. точных фраз '{exact_phrases_col}' не найдена.")
+    if not lsi_col_exists and debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"ПРЕДУПРЕЖДЕНИЕ ({lang_to_check.upper()}): Кол. LSI '{lsi_col}' не найдена.")
+    phrase_results_list = []
+    for position, (idx, df_row) in enumerate(df_excel.iterrows(), start=1):
+        base_url_from_row = str(df_row[COL_URL_RU_EXCEL])
+        if progress_callback: progress_callback(position, len(df_excel), base_url_from_row)
+        lang_data = all_site_data.get(base_url_from_row, {}).get(lang_to_check, {})
+
+        final_url_for_display = lang_data.get('final_url_fetched', base_url_from_row)
+
+        if lang_data.get('error'):
+            phrase_results_list.append({"URL": final_url_for_display, "Тип фразы": "N/A", "Фраза": "Ошибка загрузки страницы", "Статус": "❌ Ошибка"})
+            if debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"Tab2 ({lang_to_check.upper()}): Пропуск фраз {base_url_from_row}, ошибка: {lang_data.get('error','') if lang_data else ''}")
+            continue
+
+        full_text = lang_data.get('full_text', "")
+        if not full_text and debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"Tab2 ({lang_to_check.upper()}): Пустой текст для {final_url_for_display}")
+
+        page_analysis = get_page_analysis(final_url_for_display, lang_to_check, full_text)
+        current_url_phrases = {}
+        if exact_col_exists and pd.notna(df_row.get(exact_phrases_col)):
+            current_url_phrases.update(check_exact_phrases(full_text, df_row[exact_phrases_col], debug_mode, page_analysis))
+        if lsi_col_exists and pd.notna(df_row.get(lsi_col)):
+            if debug_mode and 'debug_messages' in st.session_state:
+                st.session_state.debug_messages.append(f"--- LSI для URL: {final_url_for_display} ({lang_to_check.upper()}) (Fuzzy: {lsi_settings['fuzzy_threshold']}%) ---")
+                st.session_state.debug_messages.append(f"LSI из '{lsi_col}': '{df_row.get(lsi_col)}'")
+            current_url_phrases.update(check_lsi_phrases(full_text, df_row[lsi_col], debug_mode, page_analysis, lsi_settings))
+
+        for phrase_key, found in current_url_phrases.items():
+            p_type = "Точное вхождение" if phrase_key.startswith(PREFIX_EXACT_PHRASE) else "LSI фраза"
+            act_phr = phrase_key.replace(PREFIX_EXACT_PHRASE, "").replace(PREFIX_LSI_PHRASE, "")
+            phrase_results_list.append({"URL": final_url_for_display, "Тип фразы": p_type, "Фраза": act_phr, "Статус": "✅ Найдено" if found else "❌ Не найдено"})
+    return pd.DataFrame(phrase_results_list, columns=["URL", "Тип фразы", "Фраза", "Статус"])
+
+def get_phrase_check_results(file_hash: str, lang_to_check: str, load_token: str, exact_phrases_col: str, lsi_col: str,
+                             lsi_settings: Dict[str, Any], df_excel: pd.DataFrame,
+                             all_site_data: Dict[str, Dict[str, Dict[str, Any]]], progress_callback=None) -> pd.DataFrame:
+    # Смена фильтров и чекбоксов не пересчитывает аудит: пересчёт только при новом файле, загрузке или настройках LSI.
+    # Не st.cache_data: расчёт ведёт живой прогресс в элементах страницы, а такие записи кэш воспроизвести не может.
+    # Результаты нужны только своей сессии, поэтому и хранятся в ней — до следующей загрузки страниц
+    results_cache = st.session_state.get('phrase_check_results_cache')
+    if results_cache is None or results_cache['load_token'] != load_token:
+        results_cache = st.session_state.phrase_check_results_cache = {'load_token': load_token,
+                                                                       'results': LRUCache(CHECK_RESULTS_CACHE_MAX_ENTRIES)}
+    cache_key = (file_hash, lang_to_check, exact_phrases_col, lsi_col, tuple(sorted(lsi_settings.items())))
+    phrases_df = results_cache['results'].get(cache_key)
+    if phrases_df is None:
+        phrases_df = build_phrase_check_results(df_excel, all_site_data, lang_to_check, exact_phrases_col, lsi_col, lsi_settings,
+                                                progress_callback=progress_callback)
+        results_cache['results'].put(cache_key, phrases_df)
+    return phrases_df
+
+def paginate_results(results_df: pd.DataFrame, key_prefix: str, url_columns: List[str]) -> pd.DataFrame:
+    # На странице рисуется только видимый срез: тысячи expander'ов вешают браузер и раздувают websocket
+    control_cols = st.columns([3, 1, 1])
+    with control_cols[0]:
+        url_query = st.text_input("Поиск по URL", key=f"{key_prefix}_url_search", placeholder="часть URL")
+    with control_cols[1]:
+        page_size = st.selectbox("На странице", RESULTS_PAGE_SIZE_OPTIONS, index=RESULTS_PAGE_SIZE_OPTIONS.index(DEFAULT_RESULTS_PAGE_SIZE),
+                                 key=f"{key_prefix}_page_size")
+    if url_query:
+        url_mask = pd.Series(False, index=results_df.index)
+        for url_column in url_columns:
+            url_mask |= results_df[url_column].astype(str).str.contains(url_query, case=False, regex=False, na=False)
+        results_df = results_df[url_mask]
+    total_pages = max(1, -(-len(results_df) // page_size))
+    with control_cols[2]:
+        page_number = st.number_input(f"Страница (из {total_pages})", min_value=1, max_value=total_pages, value=1, step=1,
+                                      key=f"{key_prefix}_page_{page_size}_{len(results_df)}_{url_query}")
+    start = (int(page_number) - 1) * page_size
+    st.caption(f"Показаны {min(start + 1, len(results_df))}–{min(start + page_size, len(results_df))} из {len(results_df)}")
+    return results_df.iloc[start:start + page_size]
+
+def run_checks_for_language(lang_to_check: str, df_excel: pd.DataFrame,
+                            all_site_data: Dict[str, Dict[str, Dict[str, Any]]],
+                            debug_mode: bool, file_hash: str = "", load_token: str = "", meta_only: bool = False):
+    language_columns = resolve_language_columns(lang_to_check, df_excel, debug_mode)
+    expected_title_col = language_columns['title']; expected_desc_col = language_columns['desc']
+    exact_phrases_col = language_columns['exact']; lsi_col = language_columns['lsi']
     required_cols_for_run = [COL_URL_RU_EXCEL, expected_title_col, expected_desc_col]
     missing_cols_in_df = [col for col in required_cols_for_run if col not in df_excel.columns]
     if missing_cols_in_df:
@@ -528,35 +1264,18 @@ def run_checks_for_language(lang_to_check: str, df_excel: pd.DataFrame,
         return
     sub_tab_meta, sub_tab_phrases = st.tabs([f"📋 Общая проверка Title/Description", f"🔍 Проверка фraz"])
     with sub_tab_meta:
-        tab1_errors_summary = {'load_error': 0, 'title_mismatch': 0, 'desc_mismatch': 0}
-        tab1_processed_rows_data, urls_with_meta_issues_list_tab1 = [], []
-        for index, row_from_df in df_excel.iterrows():
-            base_url_from_row = str(row_from_df[COL_URL_RU_EXCEL])
-            page_lang_specific_data = all_site_data.get(base_url_from_row, {}).get(lang_to_check, {})
-            item_details = {'url': base_url_from_row, 'final_url': page_lang_specific_data.get('final_url_fetched', base_url_from_row), 'has_issue': False, 'issue_details': []}
-            if page_lang_specific_data.get('error'):
-                tab1_errors_summary['load_error'] += 1; item_details['has_issue'] = True
-                item_details['issue_details'].append(f"Ошибка загрузки: {page_lang_specific_data['error']}")
-            else:
-                expected_title = str(row_from_df.get(expected_title_col, "")).strip()
-                expected_desc = str(row_from_df.get(expected_desc_col, "")).strip()
-                site_title = page_lang_specific_data.get('title', "").strip()
-                site_desc = page_lang_specific_data.get('description', "").strip()
-                title_match = normalize_for_search(site_title) == normalize_for_search(expected_title) if expected_title else (not site_title)
-                desc_match = normalize_for_search(site_desc) == normalize_for_search(expected_desc) if expected_desc else (not site_desc)
-                item_details.update({'expected_title': expected_title, 'expected_desc': expected_desc, 'site_title': site_title, 'site_desc': site_desc, 'title_match': title_match, 'desc_match': desc_match})
-                if not title_match: tab1_errors_summary['title_mismatch'] += 1; item_details['has_issue'] = True; item_details['issue_details'].append(f'Title не совпадает')
-                if not desc_match: tab1_errors_summary['desc_mismatch'] += 1; item_details['has_issue'] = True; item_details['issue_details'].append(f'Desc не совпадает')
-            if item_details['has_issue']: urls_with_meta_issues_list_tab1.append(item_details['final_url'])
-            tab1_processed_rows_data.append(item_details)
+        tab1_errors_summary, meta_results_df = get_meta_check_results(file_hash, lang_to_check, load_token, expected_title_col,
+                                                                      expected_desc_col, df_excel, all_site_data)
         st.info(f"Ошибок загрузки: {tab1_errors_summary['load_error']} | Несовп. Title: {tab1_errors_summary['title_mismatch']} | Несовп. Desc: {tab1_errors_summary['desc_mismatch']}")
         show_only_meta_errors_cb = st.checkbox("Показать только URL с ошибками", value=True, key=f"show_err_meta_{lang_to_check}")
-        for item_m in tab1_processed_rows_data:
-            if show_only_meta_errors_cb and not item_m['has_issue']: continue
+        displayed_meta_df = meta_results_df[meta_results_df['has_issue']] if show_only_meta_errors_cb else meta_results_df
+        displayed_meta_df = paginate_results(displayed_meta_df, f"meta_{lang_to_check}", ['url', 'final_url'])
+        for item_m in displayed_meta_df.to_dict('records'):
+            issue_details = describe_meta_issues(item_m)
             exp_icon = "✅" if not item_m['has_issue'] else "⚠️"
-            exp_title = f"{exp_icon} {item_m['final_url']}" + (f" ({', '.join(item_m['issue_details'])})" if item_m['has_issue'] else "")
-            with st.expander(exp_title, expanded=item_m['has_issue']):
-                if "Ошибка загрузки" in "".join(item_m['issue_details']): st.error(f"Не удалось получить данные. {item_m['issue_details'][0]}")
+            exp_title = f"{exp_icon} {item_m['final_url']}" + (f" ({', '.join(issue_details)})" if item_m['has_issue'] else "")
+            with st.expander(exp_title, expanded=bool(item_m['has_issue'])):
+                if item_m['error']: st.error(f"Не удалось получить данные. {issue_details[0]}")
                 else:
                     st.markdown(f"""<div class="info-box"><b>Title:</b> {'✅ Совпадает' if item_m['title_match'] else '❌ Не совпадает'}
                                 <div class="result-content"><b>Ожидалось ({expected_title_col}):</b> {html.escape(str(item_m['expected_title']))}</div>
@@ -565,48 +1284,30 @@ def run_checks_for_language(lang_to_check: str, df_excel: pd.DataFrame,
                                 <div class="result-content"><b>Ожидалось ({expected_desc_col}):</b> {html.escape(str(item_m['expected_desc']))}</div>
                                 <div class="result-content"><b>На сайте:</b> {html.escape(str(item_m['site_desc']))}</div></div>""", unsafe_allow_html=True)
     with sub_tab_phrases:
+        if meta_only:
+            st.info("Страницы загружены в режиме «только Title/Description»: текста страниц нет, проверка фраз недоступна. "
+                    "Снимите галочку и запустите проверку заново.")
+            return
         prog_bar_phrases = st.progress(0)
         stat_text_phrases = st.empty()
-        exact_col_exists = exact_phrases_col in df_excel.columns
-        lsi_col_exists = lsi_col in df_excel.columns
-        if not exact_col_exists and debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"ПРЕДУПРЕЖДЕНИЕ ({lang_to_check.upper()}): Кол. точных фраз '{exact_phrases_col}' не найдена.")
-        if not lsi_col_exists and debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"ПРЕДУПРЕЖДЕНИЕ ({lang_to_check.upper()}): Кол. LSI '{lsi_col}' не найдена.")
-        phrase_results_list = []
-        for idx, df_row in df_excel.iterrows():
-            base_url_from_row = str(df_row[COL_URL_RU_EXCEL])
-            stat_text_phrases.info(f"Анализ фраз для URL {idx + 1}/{len(df_excel)}: {base_url_from_row}")
-            prog_bar_phrases.progress((idx + 1) / len(df_excel))
-            lang_data = all_site_data.get(base_url_from_row, {}).get(lang_to_check, {})
-
-            final_url_for_display = lang_data.get('final_url_fetched', base_url_from_row)
-
-            if lang_data.get('error'):
-                phrase_results_list.append({"URL": final_url_for_display, "Тип фразы": "N/A", "Фраза": "Ошибка загрузки страницы", "Статус": "❌ Ошибка"})
-                if debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"Tab2 ({lang_to_check.upper()}): Пропуск фраз {base_url_from_row}, ошибка: {lang_data.get('error','') if lang_data else ''}")
-                continue
-
-            full_text = lang_data.get('full_text', "")
-            if not full_text and debug_mode and 'debug_messages' in st.session_state: st.session_state.debug_messages.append(f"Tab2 ({lang_to_check.upper()}): Пустой текст для {final_url_for_display}")
-
-            current_url_phrases = {}
-            if exact_col_exists and pd.notna(df_row.get(exact_phrases_col)):
-                current_url_phrases.update(check_exact_phrases(full_text, df_row[exact_phrases_col], debug_mode))
-            if lsi_col_exists and pd.notna(df_row.get(lsi_col)):
-                if debug_mode and 'debug_messages' in st.session_state:
-                    st.session_state.debug_messages.append(f"--- LSI для URL: {final_url_for_display} ({lang_to_check.upper()}) (Fuzzy: {st.session_state.get('stem_fuzzy_ratio_threshold', DEFAULT_STEM_FUZZY_RATIO_THRESHOLD)}%) ---")
-                    st.session_state.debug_messages.append(f"LSI из '{lsi_col}': '{df_row.get(lsi_col)}'")
-                current_url_phrases.update(check_lsi_phrases(full_text, df_row[lsi_col], debug_mode))
-
-            for phrase_key, found in current_url_phrases.items():
-                p_type = "Точное вхождение" if phrase_key.startswith(PREFIX_EXACT_PHRASE) else "LSI фраза"
-                act_phr = phrase_key.replace(PREFIX_EXACT_PHRASE, "").replace(PREFIX_LSI_PHRASE, "")
-                phrase_results_list.append({"URL": final_url_for_display, "Тип фразы": p_type, "Фраза": act_phr, "Статус": "✅ Найдено" if found else "❌ Не найдено"})
+
+        def update_phrases_progress(position: int, total_count: int, base_url_from_row: str):
+            stat_text_phrases.info(f"Анализ фраз для URL {position}/{total_count}: {base_url_from_row}")
+            prog_bar_phrases.progress(position / total_count)
+
+        lsi_settings = get_lsi_settings()
+        if debug_mode:
+            # В режиме отладки считаем без кэша, чтобы сообщения отладки попали в лог
+            phrases_df = build_phrase_check_results(df_excel, all_site_data, lang_to_check, exact_phrases_col, lsi_col, lsi_settings,
+                                                    debug_mode, update_phrases_progress)
+        else:
+            phrases_df = get_phrase_check_results(file_hash, lang_to_check, load_token, exact_phrases_col, lsi_col, lsi_settings,
+                                                  df_excel, all_site_data, update_phrases_progress)
 
         stat_text_phrases.success(f"Анализ фраз завершен!")
         prog_bar_phrases.empty()
 
-        if phrase_results_list:
-            phrases_df = pd.DataFrame(phrase_results_list)
+        if not phrases_df.empty:
             urls_w_failed_phr = phrases_df[phrases_df['Статус'].str.contains("❌")]['URL'].nunique()
             total_phr_not_found = len(phrases_df[phrases_df['Статус'] == "❌ Не найдено"])
             st.info(f"URL с ненайденными/ошибочными фразами: {urls_w_failed_phr} | Всего фраз не найдено: {total_phr_not_found}")
@@ -619,7 +1320,7 @@ def run_checks_for_language(lang_to_check: str, df_excel: pd.DataFrame,
             with fcols[1]: ptype_f = st.multiselect("Тип фразы", unique_types, key=f"ptype_f_t2_multi_{lang_to_check}")
             with fcols[2]: stat_f = st.selectbox("Статус", ["Все статусы"] + unique_statuses, key=f"stat_f_t2_select_{lang_to_check}")
 
-            filtered_df = phrases_df.copy()
+            filtered_df = phrases_df
             if url_f: filtered_df = filtered_df[filtered_df["URL"].isin(url_f)]
             if ptype_f: filtered_df = filtered_df[filtered_df["Тип фразы"].isin(ptype_f)]
             if stat_f != "Все статусы": filtered_df = filtered_df[filtered_df["Статус"] == stat_f]
@@ -639,166 +1340,426 @@ URL_TEMPLATES = [
 ]
 DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
 
+IMAGE_REQUEST_TIMEOUT = 20
+IMAGE_CHECK_MODES = {
+    'probe': "HEAD, при отказе — GET одного байта (без загрузки изображений)",
+    'get': "Полный GET (как раньше)",
+}
+DEFAULT_IMAGE_CHECK_MODE = 'probe'
+# Ответы, которыми серверы отклоняют сам метод HEAD: тогда повторяем GET с Range
+IMAGE_HEAD_FALLBACK_STATUSES = (403, 405, 501)
+
+# --- АДАПТИВНАЯ ПАРАЛЛЕЛЬНОСТЬ (AIMD) ---
+IMAGE_MAX_CONCURRENCY_LIMIT = 100
+IMAGE_AIMD_INITIAL_LIMIT = 8
+IMAGE_AIMD_DECREASE_FACTOR = 0.5
+# Ответ считается «здоровым», пока он не медленнее минимальной наблюдавшейся задержки в столько раз
+IMAGE_AIMD_LATENCY_FACTOR = 3.0
+# На эти статусы запрос повторяется после паузы из Retry-After (или IMAGE_DEFAULT_RETRY_AFTER)
+IMAGE_RETRY_AFTER_STATUSES = (429, 503)
+IMAGE_MAX_RETRIES = 2
+IMAGE_DEFAULT_RETRY_AFTER = 1.0
+IMAGE_MAX_RETRY_AFTER = 60.0
+# Скорость в статусе считается по завершённым запросам за последние столько секунд
+IMAGE_RPS_WINDOW_SECONDS = 5.0
+
+# --- ХРАНИЛИЩЕ РЕЗУЛЬТАТОВ ПРОВЕРКИ ИЗОБРАЖЕНИЙ ---
+IMAGE_RUN_MODES = {
+    'full': "Полная проверка: все ID заново",
+    'resume': "Продолжить: пропустить всё, что уже проверено",
+    'recheck': "Перепроверить только ошибки и устаревшие результаты",
+}
+DEFAULT_IMAGE_RUN_MODE = 'full'
+DEFAULT_IMAGE_RECHECK_TTL_HOURS = 24
+IMAGE_STORE_FLUSH_EVERY = 100
+IMAGE_STORE_LOOKUP_CHUNK = 500
+IMAGE_LIVE_TABLE_ROWS = 200
+IMAGE_LIVE_REFRESH_SECONDS = 1.0
+
+@dataclass(slots=True)
+class ImageUrlCheck:
+    # Результат проверки одного шаблона URL для одного ID
+    extension_type: str
+    url: str
+    final_url: str
+    status_code: Optional[int]
+    message: str
+    details: str = ""
+    from_store: bool = False
+
+    @property
+    def is_ok(self) -> bool:
+        return "ОК" in self.message
+
+@dataclass(slots=True)
+class PharmacyImageResult:
+    # Итоговая строка отчёта по ID; порядок полей совпадает с IMAGE_RESULT_COLUMNS
+    pharmacy_id: Any
+    result: str
+    found_format: str
+    final_url: Any
+    http_status: Any
+    generated_url: str
+    details: str
+
+IMAGE_RESULT_COLUMNS = {
+    'pharmacy_id': "ID аптеки", 'result': "Результат", 'found_format': "Найденный формат",
+    'final_url': "Конечный URL (если найден)", 'http_status': "HTTP Статус (конечный)",
+    'generated_url': "Сгенерированный URL (JPEG вариант)", 'details': "Детали по вариантам/ошибкам",
+}
+
+def image_results_to_dataframe(results: Iterable[PharmacyImageResult]) -> pd.DataFrame:
+    results = list(results)
+    return pd.DataFrame({column: [getattr(item, field) for item in results] for field, column in IMAGE_RESULT_COLUMNS.items()})
+
+class ImageCheckStore:
+    # Результаты проверки по ключу (ID, шаблон URL): пишутся по мере готовности, чтобы прерванный запуск можно было продолжить
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS image_checks (
+                                  pharmacy_id TEXT NOT NULL, template TEXT NOT NULL, result TEXT NOT NULL,
+                                  is_ok INTEGER NOT NULL, checked_at REAL NOT NULL, PRIMARY KEY (pharmacy_id, template))""")
+        self._conn.commit()
+        self._pending: List[Tuple[str, str, str, int, float]] = []
+
+    def load(self, pharmacy_ids: List[str], templates: List[str]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        stored = {}
+        unique_ids = list(dict.fromkeys(pharmacy_ids))
+        template_placeholders = ",".join("?" * len(templates))
+        with self._lock:
+            for start in range(0, len(unique_ids), IMAGE_STORE_LOOKUP_CHUNK):
+                chunk = unique_ids[start:start + IMAGE_STORE_LOOKUP_CHUNK]
+                rows = self._conn.execute(f"""SELECT pharmacy_id, template, result, is_ok, checked_at FROM image_checks
+                                              WHERE pharmacy_id IN ({",".join("?" * len(chunk))})
+                                              AND template IN ({template_placeholders})""", (*chunk, *templates)).fetchall()
+                for pharmacy_id, template, result, is_ok, checked_at in rows:
+                    values = json.loads(result)
+                    if not isinstance(values, list) or len(values) != 6: continue  # запись старого формата — проверим заново
+                    stored[(pharmacy_id, template)] = {'check': ImageUrlCheck(*values, from_store=True), 'is_ok': bool(is_ok), 'checked_at': checked_at}
+        return stored
+
+    def save(self, pharmacy_id: str, template: str, check: ImageUrlCheck):
+        values = [check.extension_type, check.url, check.final_url, check.status_code, check.message, check.details]
+        self._pending.append((pharmacy_id, template, json.dumps(values, ensure_ascii=False), int(check.is_ok), time.time()))
+        if len(self._pending) >= IMAGE_STORE_FLUSH_EVERY: self.flush()
+
+    def flush(self):
+        if not self._pending: return
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._conn.executemany("INSERT OR REPLACE INTO image_checks VALUES (?, ?, ?, ?, ?)", pending)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._pending = []
+            self._conn.execute("DELETE FROM image_checks")
+            self._conn.commit()
+
+@st.cache_resource
+def get_image_check_store() -> ImageCheckStore:
+    return ImageCheckStore(IMAGE_CHECK_DB_PATH)
+
+def is_stored_check_reusable(stored_check: Optional[Dict[str, Any]], run_mode: str, recheck_ttl_seconds: float) -> bool:
+    if stored_check is None or run_mode == 'full': return False
+    if run_mode == 'resume': return True
+    return stored_check['is_ok'] and time.time() - stored_check['checked_at'] < recheck_ttl_seconds
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value: return None
+    value = value.strip()
+    if value.isdigit(): return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None: return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+class AdaptiveConcurrencyLimiter:
+    # Лимит растёт на 1 за «окно» из limit здоровых ответов и делится пополам на таймаутах, 429 и 5xx
+    # (не чаще раза за среднюю задержку, чтобы одна пачка ошибок не обнулила лимит). Retry-After ставит паузу для всех.
+    def __init__(self, max_limit: int, initial_limit: int = IMAGE_AIMD_INITIAL_LIMIT, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = min(min_limit, self.max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.completed = 0
+        self.started_at = time.monotonic()
+        self._completion_times = deque()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._min_latency: Optional[float] = None
+        self._avg_latency: Optional[float] = None
+        self._condition = asyncio.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    @property
+    def requests_per_second(self) -> float:
+        now = time.monotonic()
+        while self._completion_times and self._completion_times[0] < now - IMAGE_RPS_WINDOW_SECONDS:
+            self._completion_times.popleft()
+        window = min(IMAGE_RPS_WINDOW_SECONDS, now - self.started_at)
+        return len(self._completion_times) / window if window > 0 else 0.0
+
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    try: await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError: pass
+                elif self.in_flight < self.current_limit: break
+                else: await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self, latency: float, overloaded: bool = False, retry_after: Optional[float] = None):
+        async with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.completed += 1
+            self._completion_times.append(now)
+            self._avg_latency = latency if self._avg_latency is None else 0.8 * self._avg_latency + 0.2 * latency
+            if overloaded:
+                if now - self._last_decrease >= (self._avg_latency or 0.0):
+                    self.limit = max(float(self.min_limit), self.limit * IMAGE_AIMD_DECREASE_FACTOR)
+                    self._last_decrease = now
+            else:
+                self._min_latency = latency if self._min_latency is None else min(self._min_latency, latency)
+                if latency <= self._min_latency * IMAGE_AIMD_LATENCY_FACTOR:
+                    self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, now + min(retry_after, IMAGE_MAX_RETRY_AFTER))
+            self._condition.notify_all()
+
+def classify_image_status(status_code: int, generated_url: str, final_url: str) -> str:
+    if 200 <= status_code < 300: return "ОК" if generated_url == final_url else "Редирект ОК"
+    elif status_code == 404: return "Не найдено (404)"
+    elif status_code == 403: return "Запрещено (403)"
+    elif 400 <= status_code < 500: return f"Ошибка клиента ({status_code})"
+    elif 500 <= status_code < 600: return f"Ошибка сервера ({status_code})"
+    else: return f"Другой статус ({status_code})"
+
+async def probe_image_url(http_session: aiohttp.ClientSession, url_to_check: str, headers: Dict[str, str],
+                          timeout: aiohttp.ClientTimeout) -> Tuple[int, str, Optional[str]]:
+    # Тело изображения не читается ни в одном из запросов
+    async with http_session.head(url_to_check, headers=headers, timeout=timeout, ssl=False, allow_redirects=True) as response:
+        if response.status not in IMAGE_HEAD_FALLBACK_STATUSES:
+            return response.status, str(response.url), response.headers.get('Retry-After')
+    range_headers = {**headers, 'Range': 'bytes=0-0'}
+    async with http_session.get(url_to_check, headers=range_headers, timeout=timeout, ssl=False, allow_redirects=True) as response:
+        # 416 на bytes=0-0 — файл есть, но пустой: обычный GET вернул бы для него 200
+        return (200 if response.status == 416 else response.status), str(response.url), response.headers.get('Retry-After')
+
 async def fetch_url_status(
     http_session: aiohttp.ClientSession, 
-    pharmacy_id: any, 
     url_to_check: str, 
     original_extension_type: str, 
-    semaphore: asyncio.Semaphore
-) -> dict:
-    async with semaphore:
-        generated_url = url_to_check
+    limiter: AdaptiveConcurrencyLimiter,
+    check_mode: str = DEFAULT_IMAGE_CHECK_MODE
+) -> ImageUrlCheck:
+    generated_url = url_to_check
+    headers = {'User-Agent': DEFAULT_USER_AGENT}
+    request_timeout = aiohttp.ClientTimeout(total=IMAGE_REQUEST_TIMEOUT)
+    for attempt in range(IMAGE_MAX_RETRIES + 1):
         final_url = ""
         status_code = None
         status_message = "Неизвестная ошибка"
         error_details = ""
-        headers = {'User-Agent': DEFAULT_USER_AGENT}
+        retry_after_header = None
+        overloaded = False
+        await limiter.acquire()
+        request_started = time.monotonic()
         try:
-            async with http_session.get(url_to_check, headers=headers, timeout=aiohttp.ClientTimeout(total=20), ssl=False) as response:
-                final_url = str(response.url)
-                status_code = response.status
-                if 200 <= status_code < 300: status_message = "ОК" if generated_url == final_url else "Редирект ОК"
-                elif status_code == 404: status_message = "Не найдено (404)"
-                elif status_code == 403: status_message = "Запрещено (403)"
-                elif 400 <= status_code < 500: status_message = f"Ошибка клиента ({status_code})"
-                elif 500 <= status_code < 600: status_message = f"Ошибка сервера ({status_code})"
-                else: status_message = f"Другой статус ({status_code})"
-        except asyncio.TimeoutError: status_message = "Таймаут"; error_details = "Запрос > 20 сек"; final_url = generated_url
+            if check_mode == 'probe':
+                status_code, final_url, retry_after_header = await probe_image_url(http_session, url_to_check, headers, request_timeout)
+            else:
+                async with http_session.get(url_to_check, headers=headers, timeout=request_timeout, ssl=False) as response:
+                    final_url = str(response.url)
+                    status_code = response.status
+                    retry_after_header = response.headers.get('Retry-After')
+            status_message = classify_image_status(status_code, generated_url, final_url)
+            overloaded = status_code == 429 or 500 <= status_code < 600
+        except asyncio.TimeoutError: status_message = "Таймаут"; error_details = f"Запрос > {IMAGE_REQUEST_TIMEOUT} сек"; final_url = generated_url; overloaded = True
         except aiohttp.ClientConnectorError as e: status_message = "Ошибка соединения"; error_details = str(e); final_url = generated_url
         except aiohttp.ClientError as e: status_message = "Ошибка клиента (aiohttp)"; error_details = str(e); final_url = generated_url
         except Exception as e: status_message = "Непредвиденная ошибка"; error_details = str(e); final_url = generated_url
-        await asyncio.sleep(0.05)
-        return {
-            "ID аптеки (исходный)": pharmacy_id,
-            "Тип файла (проверенный)": original_extension_type.upper(),
-            "Проверяемый URL": generated_url,
-            "Конечный URL проверки": final_url,
-            "HTTP Статус проверки": status_code,
-            "Результат проверки URL": status_message,
-            "Детали ошибки URL": error_details
-        }
+        retry_after = None
+        if status_code in IMAGE_RETRY_AFTER_STATUSES:
+            retry_after = parse_retry_after(retry_after_header)
+            if retry_after is None: retry_after = IMAGE_DEFAULT_RETRY_AFTER
+        elif overloaded and retry_after_header:
+            retry_after = parse_retry_after(retry_after_header)
+        await limiter.release(time.monotonic() - request_started, overloaded, retry_after)
+        if status_code not in IMAGE_RETRY_AFTER_STATUSES: break
+        error_details = f"Попыток: {attempt + 1}, Retry-After: {retry_after_header or 'нет'}"
+    return ImageUrlCheck(original_extension_type.upper(), generated_url, final_url, status_code, status_message, error_details)
+
+def get_template_extension_type(template: str) -> str:
+    return "JPEG" if ".jpeg" in template.lower() else "PNG" if ".png" in template.lower() else "UNKNOWN"
+
+async def check_pharmacy_formats(
+    http_session: aiohttp.ClientSession,
+    cleaned_id: str,
+    url_templates_list: list,
+    limiter: AdaptiveConcurrencyLimiter,
+    check_mode: str = DEFAULT_IMAGE_CHECK_MODE,
+    first_hit_wins: bool = True,
+    store: Optional[ImageCheckStore] = None,
+    stored_checks: Optional[Dict[str, Dict[str, Any]]] = None,
+    run_mode: str = 'full',
+    recheck_ttl_seconds: float = DEFAULT_IMAGE_RECHECK_TTL_HOURS * 3600
+) -> List[ImageUrlCheck]:
+    # Все шаблоны одного ID. «Первый найденный»: по порядку URL_TEMPLATES (JPEG, затем PNG) до первого 2xx.
+    # Сохранённый результат шаблона берётся вместо запроса, если его допускает режим запуска
+    stored_checks = stored_checks or {}
+
+    async def check_template(template: str) -> ImageUrlCheck:
+        stored_check = stored_checks.get(template)
+        if is_stored_check_reusable(stored_check, run_mode, recheck_ttl_seconds):
+            return stored_check['check']
+        check = await fetch_url_status(http_session, template.replace("{ID}", cleaned_id),
+                                       get_template_extension_type(template), limiter, check_mode)
+        if store is not None: store.save(cleaned_id, template, check)
+        return check
+
+    if not first_hit_wins:
+        return list(await asyncio.gather(*(check_template(template) for template in url_templates_list)))
+    checks = []
+    for template in url_templates_list:
+        check = await check_template(template)
+        checks.append(check)
+        if check.is_ok: break
+    return checks
+
+def build_template_url(url_templates_list: list, template_index: int, cleaned_id: str) -> str:
+    if len(url_templates_list) > template_index and "{ID}" in url_templates_list[template_index]:
+        return url_templates_list[template_index].replace("{ID}", cleaned_id)
+    return "N/A (ошибка ID)"
+
+def aggregate_pharmacy_checks(pharmacy_id: Any, cleaned_id: str, checks: List[ImageUrlCheck], url_templates_list: list) -> PharmacyImageResult:
+    checks_by_type: Dict[str, ImageUrlCheck] = {}
+    for check in checks: checks_by_type.setdefault(check.extension_type, check)
+    jpeg_check = checks_by_type.get("JPEG")
+    png_check = checks_by_type.get("PNG")
+    jpeg_template_url = build_template_url(url_templates_list, 0, cleaned_id)
+    is_jpeg_ok = jpeg_check is not None and jpeg_check.is_ok
+    is_png_ok = png_check is not None and png_check.is_ok
+    if is_jpeg_ok and is_png_ok:
+        return PharmacyImageResult(pharmacy_id, "✅ ОК", "JPEG и PNG", f"JPEG: {jpeg_check.final_url}", jpeg_check.status_code, jpeg_template_url, "")
+    if is_jpeg_ok:
+        return PharmacyImageResult(pharmacy_id, "✅ ОК", "JPEG", jpeg_check.final_url, jpeg_check.status_code, jpeg_template_url, "")
+    if is_png_ok:
+        return PharmacyImageResult(pharmacy_id, "✅ ОК", "PNG", png_check.final_url, png_check.status_code, jpeg_template_url, "")
+    png_template_url = build_template_url(url_templates_list, 1, cleaned_id)
+    error_details_parts = [
+        f"JPEG: {jpeg_check.message} ({jpeg_check.url or jpeg_template_url})" if jpeg_check
+        else f"JPEG: Проверка не проводилась или ошибка ({jpeg_template_url})",
+        f"PNG: {png_check.message} ({png_check.url or png_template_url})" if png_check
+        else f"PNG: Проверка не проводилась или ошибка ({png_template_url})",
+    ]
+    return PharmacyImageResult(pharmacy_id, "❌ Не найдено (в обоих форматах)", "Нет",
+                               jpeg_check.final_url if jpeg_check else jpeg_template_url,
+                               jpeg_check.status_code if jpeg_check else "N/A", jpeg_template_url, "; ".join(error_details_parts))
 
 async def run_all_checks_async(
     pharmacy_ids_with_raw_values: list,
     url_templates_list: list,
     max_concurrent: int,
     progress_bar_ui,
-    status_text_ui
-) -> list:
-    all_individual_check_results = []
-    semaphore = asyncio.Semaphore(max_concurrent)
-    connector = aiohttp.TCPConnector(ssl=False)
-    async with aiohttp.ClientSession(connector=connector) as http_session:
-        tasks = []
-        for pharmacy_id_raw, cleaned_id_str_or_none in pharmacy_ids_with_raw_values:
-            if cleaned_id_str_or_none is None:
-                actual_id_for_report = str(pharmacy_id_raw) if not pd.isna(pharmacy_id_raw) else "ПУСТОЙ_ИЛИ_NAN_ID"
-                for template in url_templates_list:
-                    ext_type = "JPEG" if ".jpeg" in template.lower() else "PNG" if ".png" in template.lower() else "UNKNOWN"
-                    all_individual_check_results.append({
-                        "ID аптеки (исходный)": actual_id_for_report,
-                        "Тип файла (проверенный)": ext_type,
-                        "Проверяемый URL": "N/A (пустой или невалидный ID)",
-                        "Конечный URL проверки": "N/A",
-                        "HTTP Статус проверки": None,
-                        "Результат проверки URL": "Пропущено (ID невалиден)",
-                        "Детали ошибки URL": ""
-                    })
-                continue
-            for template in url_templates_list:
-                url_to_check = template.replace("{ID}", cleaned_id_str_or_none)
-                extension_type = "JPEG" if ".jpeg" in template.lower() else "PNG" if ".png" in template.lower() else "UNKNOWN"
-                tasks.append(fetch_url_status(http_session, pharmacy_id_raw, url_to_check, extension_type, semaphore))
-        total_tasks_to_run = len(tasks)
-        processed_tasks_count = 0
-        if progress_bar_ui: progress_bar_ui.progress(0.0)
-        if status_text_ui: status_text_ui.text(f"Обработано URL: 0/{total_tasks_to_run} (Всего ID для проверки: {len(pharmacy_ids_with_raw_values)})")
-        for i, future in enumerate(asyncio.as_completed(tasks)):
-            result_item = None
+    status_text_ui,
+    check_mode: str = DEFAULT_IMAGE_CHECK_MODE,
+    first_hit_wins: bool = True,
+    store: Optional[ImageCheckStore] = None,
+    run_mode: str = 'full',
+    recheck_ttl_seconds: float = DEFAULT_IMAGE_RECHECK_TTL_HOURS * 3600,
+    results_table_ui=None
+) -> List[PharmacyImageResult]:
+    # Каждый ID сводится в строку отчёта сразу после своих проверок; в памяти — только итоговые записи.
+    # Повторяющиеся ID проверяются один раз, невалидные попадают в отчёт сразу
+    results: List[PharmacyImageResult] = []
+    ids_to_check: Dict[str, Any] = {}
+    skipped_ids = set()
+    for pharmacy_id_raw, cleaned_id in pharmacy_ids_with_raw_values:
+        if cleaned_id is not None:
+            ids_to_check.setdefault(cleaned_id, pharmacy_id_raw)
+            continue
+        actual_id_for_report = str(pharmacy_id_raw) if not pd.isna(pharmacy_id_raw) else "ПУСТОЙ_ИЛИ_NAN_ID"
+        if actual_id_for_report in skipped_ids: continue
+        skipped_ids.add(actual_id_for_report)
+        results.append(PharmacyImageResult(actual_id_for_report, "⚠️ Пропущено (ID невалиден)", "N/A", "N/A", "N/A",
+                                           "N/A (пустой или невалидный ID)", ""))
+    total_ids = len(ids_to_check)
+    worker_count = max(1, min(max_concurrent, total_ids))
+    limiter = AdaptiveConcurrencyLimiter(max_concurrent)
+    recent_results = deque(results[-IMAGE_LIVE_TABLE_ROWS:], maxlen=IMAGE_LIVE_TABLE_ROWS)
+    progress = {'done': 0, 'found': 0, 'reused': 0, 'refreshed_at': 0.0}
+
+    def refresh_ui(force: bool = False):
+        now = time.monotonic()
+        if not force and now - progress['refreshed_at'] < IMAGE_LIVE_REFRESH_SECONDS: return
+        progress['refreshed_at'] = now
+        if progress_bar_ui: progress_bar_ui.progress(progress['done'] / total_ids if total_ids else 1.0)
+        if status_text_ui:
+            status_text_ui.text(f"Проверено ID: {progress['done']}/{total_ids} · найдено: {progress['found']} · "
+                                f"параллельно: {limiter.in_flight}/{limiter.current_limit} · {limiter.requests_per_second:.1f} запр/с · "
+                                f"из сохранённых: {progress['reused']}")
+        if results_table_ui is not None and recent_results:
+            results_table_ui.dataframe(image_results_to_dataframe(reversed(recent_results)))
+
+    id_queue: asyncio.Queue = asyncio.Queue(maxsize=worker_count * 2)
+
+    async def produce_ids():
+        # Сохранённые результаты подгружаются порциями по мере продвижения очереди, а не для всего файла сразу
+        id_items = iter(ids_to_check.items())
+        while True:
+            chunk = list(islice(id_items, IMAGE_STORE_LOOKUP_CHUNK))
+            if not chunk: break
+            stored = store.load([cleaned_id for cleaned_id, _ in chunk], url_templates_list) if store is not None and run_mode != 'full' else {}
+            for cleaned_id, pharmacy_id_raw in chunk:
+                stored_for_id = {template: stored[(cleaned_id, template)] for template in url_templates_list if (cleaned_id, template) in stored}
+                await id_queue.put((pharmacy_id_raw, cleaned_id, stored_for_id))
+        for _ in range(worker_count): await id_queue.put(None)
+
+    async def check_ids(http_session: aiohttp.ClientSession):
+        while True:
+            queue_item = await id_queue.get()
+            if queue_item is None: return
+            pharmacy_id_raw, cleaned_id, stored_for_id = queue_item
             try:
-                result_item = await future
-                all_individual_check_results.append(result_item)
+                checks = await check_pharmacy_formats(http_session, cleaned_id, url_templates_list, limiter, check_mode,
+                                                      first_hit_wins, store, stored_for_id, run_mode, recheck_ttl_seconds)
+                result = aggregate_pharmacy_checks(pharmacy_id_raw, cleaned_id, checks, url_templates_list)
+                progress['reused'] += sum(1 for check in checks if check.from_store)
             except Exception as e_task:
-                all_individual_check_results.append({
-                    "ID аптеки (исходный)": f"Ошибка асинхр. задачи (неизвестный ID)",
-                    "Тип файла (проверенный)": "ERROR",
-                    "Проверяемый URL": "N/A", "Конечный URL проверки": "N/A",
-                    "HTTP Статус проверки": None, "Результат проверки URL": "Ошибка выполнения задачи",
-                    "Детали ошибки URL": str(e_task)
-                })
-            processed_tasks_count += 1
-            if progress_bar_ui: progress_bar_ui.progress(processed_tasks_count / total_tasks_to_run if total_tasks_to_run > 0 else 0)
-            if status_text_ui:
-                id_disp = result_item.get('ID аптеки (исходный)', f'задача {i+1}') if result_item else f'задача {i+1} (ошибка)'
-                status_text_ui.text(f"Проверка URL: {processed_tasks_count}/{total_tasks_to_run} (ID: {id_disp})")
-    final_aggregated_results = []
-    results_by_pharmacy_id = {}
-    for res_item in all_individual_check_results:
-        pid_raw = res_item.get("ID аптеки (исходный)")
-        pid_group_key = str(pid_raw) if not (isinstance(pid_raw, str) and "Ошибка асинхр. задачи" in pid_raw) else f"ERROR_TASK_{time.time()}"
-        if pid_group_key not in results_by_pharmacy_id:
-            results_by_pharmacy_id[pid_group_key] = {'raw_id': pid_raw, 'checks': []}
-        results_by_pharmacy_id[pid_group_key]['checks'].append(res_item)
-    for pharmacy_id_key, data in results_by_pharmacy_id.items():
-        pharmacy_id_original = data['raw_id']
-        checks_for_id = data['checks']
-        if len(checks_for_id) == 1 and "Пропущено" in checks_for_id[0].get("Результат проверки URL", ""):
-            final_aggregated_results.append({
-                "ID аптеки": pharmacy_id_original,
-                "Сгенерированный URL (основной)": checks_for_id[0].get("Проверяемый URL", "N/A"),
-                "Результат": checks_for_id[0].get("Результат проверки URL", "Ошибка данных"),
-                "Найденный формат": checks_for_id[0].get("Тип файла (проверенный)", "N/A"),
-                "Конечный URL (найденного)": checks_for_id[0].get("Конечный URL проверки", "N/A"),
-                "HTTP Статус (конечный)": checks_for_id[0].get("HTTP Статус проверки", "N/A"),
-                "Детали по ошибкам (если есть)": checks_for_id[0].get("Детали ошибки URL", "")
-            })
-            continue
-        jpeg_check = next((c for c in checks_for_id if c.get("Тип файла (проверенный)") == "JPEG"), None)
-        png_check = next((c for c in checks_for_id if c.get("Тип файла (проверенный)") == "PNG"), None)
-        is_jpeg_ok = jpeg_check and "ОК" in jpeg_check.get("Результат проверки URL", "")
-        is_png_ok = png_check and "ОК" in png_check.get("Результат проверки URL", "")
-        aggregated_status = "❌ Не найдено (в обоих форматах)"
-        found_format_details = "Нет"
-        final_url_display = "N/A"
-        http_status_display = "N/A"
-        error_details_parts = []
-        base_id_str_for_template = str(pharmacy_id_original)
-        if base_id_str_for_template.endswith(".0"): base_id_str_for_template = base_id_str_for_template[:-2]
-        generated_url_template_ref = "N/A (ошибка ID)"
-        if base_id_str_for_template and not pd.isna(pharmacy_id_original) and "{ID}" in url_templates_list[0] :
-            generated_url_template_ref = url_templates_list[0].replace("{ID}", base_id_str_for_template)
-        if is_jpeg_ok and is_png_ok:
-            aggregated_status = "✅ ОК"; found_format_details = "JPEG и PNG"
-            final_url_display = f"JPEG: {jpeg_check['Конечный URL проверки']}"
-            http_status_display = jpeg_check['HTTP Статус проверки']
-        elif is_jpeg_ok:
-            aggregated_status = "✅ ОК"; found_format_details = "JPEG"
-            final_url_display = jpeg_check['Конечный URL проверки']
-            http_status_display = jpeg_check['HTTP Статус проверки']
-        elif is_png_ok:
-            aggregated_status = "✅ ОК"; found_format_details = "PNG"
-            final_url_display = png_check['Конечный URL проверки']
-            http_status_display = png_check['HTTP Статус проверки']
-        else:
-            if jpeg_check: error_details_parts.append(f"JPEG: {jpeg_check.get('Результат проверки URL','N/A')} ({jpeg_check.get('Проверяемый URL') or generated_url_template_ref})")
-            else: error_details_parts.append(f"JPEG: Проверка не проводилась или ошибка ({generated_url_template_ref})")
-            png_template_url_ref = "N/A (ошибка ID)"
-            if base_id_str_for_template and not pd.isna(pharmacy_id_original) and len(url_templates_list) > 1 and "{ID}" in url_templates_list[1]:
-                png_template_url_ref = url_templates_list[1].replace("{ID}", base_id_str_for_template)
-            if png_check: error_details_parts.append(f"PNG: {png_check.get('Результат проверки URL','N/A')} ({png_check.get('Проверяемый URL') or png_template_url_ref})")
-            else: error_details_parts.append(f"PNG: Проверка не проводилась или ошибка ({png_template_url_ref})")
-            if final_url_display == "N/A": final_url_display = jpeg_check.get('Конечный URL проверки', generated_url_template_ref) if jpeg_check else generated_url_template_ref
-            if http_status_display == "N/A": http_status_display = jpeg_check.get('HTTP Статус проверки', "N/A") if jpeg_check else "N/A"
-        final_aggregated_results.append({
-            "ID аптеки": pharmacy_id_original,
-            "Результат": aggregated_status,
-            "Найденный формат": found_format_details,
-            "Сгенерированный URL (JPEG вариант)": generated_url_template_ref,
-            "Конечный URL (если найден)": final_url_display,
-            "HTTP Статус (конечный)": http_status_display,
-            "Детали по вариантам/ошибкам": "; ".join(error_details_parts) if error_details_parts else ""
-        })
-    return final_aggregated_results
+                result = PharmacyImageResult(pharmacy_id_raw, "Ошибка выполнения задачи", "N/A", "N/A", "N/A",
+                                             build_template_url(url_templates_list, 0, cleaned_id), str(e_task))
+            results.append(result)
+            recent_results.append(result)
+            progress['done'] += 1
+            if result.result == "✅ ОК": progress['found'] += 1
+            refresh_ui()
+
+    refresh_ui(force=True)
+    connector = aiohttp.TCPConnector(ssl=False, limit=max_concurrent)
+    async with aiohttp.ClientSession(connector=connector) as http_session:
+        tasks = [asyncio.ensure_future(produce_ids())] + [asyncio.ensure_future(check_ids(http_session)) for _ in range(worker_count)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # При прерывании незавершённые задачи снимаются до закрытия сессии, иначе они запишут в хранилище
+            # ошибки «Session is closed»; всё, что успело завершиться, остаётся сохранённым
+            for task in tasks: task.cancel()
+            if store is not None: store.flush()
+    refresh_ui(force=True)
+    return results
 
 def pharmacy_image_url_checker_tab():
     st.title("⚕️ Проверка доступности изображений аптек (JPEG и PNG)")
@@ -820,10 +1781,26 @@ def pharmacy_image_url_checker_tab():
                 st.markdown("---")
                 st.subheader("2. Настройки проверки")
                 max_concurrent_requests = st.slider(
-                    "Количество параллельных запросов:",
-                    min_value=1, max_value=30, value=10,
-                    help="Определяет, сколько URL будет проверяться одновременно."
+                    "Максимум параллельных запросов:",
+                    min_value=1, max_value=IMAGE_MAX_CONCURRENCY_LIMIT, value=30,
+                    help=f"Верхняя граница. Проверка стартует с {IMAGE_AIMD_INITIAL_LIMIT} запросов и сама увеличивает их число, "
+                         "пока сервер отвечает быстро, и снижает при таймаутах, 429 и 5xx."
                 )
+                image_check_mode = st.radio("Способ проверки URL:", list(IMAGE_CHECK_MODES), format_func=IMAGE_CHECK_MODES.get,
+                                            index=list(IMAGE_CHECK_MODES).index(DEFAULT_IMAGE_CHECK_MODE), key="image_check_mode_radio")
+                first_hit_wins = st.checkbox("Останавливаться на первом найденном формате (JPEG, затем PNG)", value=True,
+                                             key="image_first_hit_cb",
+                                             help="Снимите, если для аудита нужен статус обоих форматов.")
+                image_run_mode = st.radio("Режим запуска:", list(IMAGE_RUN_MODES), format_func=IMAGE_RUN_MODES.get,
+                                          index=list(IMAGE_RUN_MODES).index(DEFAULT_IMAGE_RUN_MODE), key="image_run_mode_radio",
+                                          help="Результаты сохраняются по мере проверки, поэтому прерванный запуск можно продолжить.")
+                recheck_ttl_hours = DEFAULT_IMAGE_RECHECK_TTL_HOURS
+                if image_run_mode == 'recheck':
+                    recheck_ttl_hours = st.number_input("Считать успешный результат устаревшим через, ч:", min_value=1, max_value=24 * 90,
+                                                        value=DEFAULT_IMAGE_RECHECK_TTL_HOURS, step=1, key="image_recheck_ttl_hours")
+                if st.button("🗑️ Очистить сохранённые результаты проверок", key="clear_image_store_button"):
+                    get_image_check_store().clear()
+                    st.success("Сохранённые результаты удалены.")
                 if st.button("🚀 Начать проверку!", key="start_check_button"):
                     ids_to_check_raw = df[ID_COLUMN_NAME_EXCEL].tolist()
                     pharmacy_ids_with_raw_values_for_run = []
@@ -842,17 +1819,21 @@ def pharmacy_image_url_checker_tab():
                         progress_bar_ui = st.progress(0.0)
                         status_text_ui = st.empty()
                         status_text_ui.text("Инициализация...")
+                        live_table_ui = st.empty()
                         all_results_aggregated = []
                         try:
                             all_results_aggregated = asyncio.run(
-                                run_all_checks_async(pharmacy_ids_with_raw_values_for_run, URL_TEMPLATES, max_concurrent_requests, progress_bar_ui, status_text_ui)
+                                run_all_checks_async(pharmacy_ids_with_raw_values_for_run, URL_TEMPLATES, max_concurrent_requests, progress_bar_ui, status_text_ui,
+                                                     image_check_mode, first_hit_wins, get_image_check_store(),
+                                                     image_run_mode, recheck_ttl_hours * 3600, live_table_ui)
                             )
                         except Exception as e_async_run:
                              st.error(f"Ошибка при выполнении асинхронных задач: {e_async_run}")
                              st.exception(e_async_run)
+                        live_table_ui.empty()
                         status_text_ui.success(f"Проверка завершена! Обработано записей: {len(all_results_aggregated)}.")
                         if all_results_aggregated:
-                            results_df = pd.DataFrame(all_results_aggregated)
+                            results_df = image_results_to_dataframe(all_results_aggregated)
                             cols_order = ["ID аптеки", "Результат", "Найденный формат", "Конечный URL (если найден)", "HTTP Статус (конечный)", "Сгенерированный URL (JPEG вариант)", "Детали по вариантам/ошибкам"]
                             final_cols = [col for col in cols_order if col in results_df.columns]
                             results_df_display = results_df[final_cols]
@@ -1136,7 +2117,6 @@ def main():
     if tab == "🧪 Tittle_Description +":
         import tempfile
         import altair as alt
-        from difflib import SequenceMatcher
 
         st.set_page_config(page_title="SEO Мета-Проверка Apteka 9-1-1", layout="wide")
         st.title("🔍 SEO Мета-Проверка для сайта Apteka 9-1-1")
@@ -1202,33 +2182,6 @@ def main():
         </style>
         """, unsafe_allow_html=True)
 
-        def clean_text(text):
-            text = str(text).lower()
-            text = re.sub(r'%min_price%', '', text)
-            text = re.sub(r'цена от [^|\n\r-]+', '', text)
-            text = re.sub(r'цiна вiд [^|\n\r-]+', '', text)
-            text = re.sub(r'[\-\|:,⭐⏩⚡🔹📦→®]', '', text)
-            text = re.sub(r'грн|uah', '', text)
-            text = re.sub(r'\s+', ' ', text)
-            return text.strip()
-
-        def get_similarity(text1, text2):
-            return round(SequenceMatcher(None, text1, text2).ratio() * 100, 1)
-
-        def get_meta_from_url(url):
-            try:
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                response = requests.get(url, headers=headers, timeout=10)
-                soup = BeautifulSoup(response.text, 'html.parser')
-                title = soup.title.string.strip() if soup.title else ''
-                description = ''
-                tag = soup.find("meta", attrs={"name": "description"})
-                if tag and tag.get("content"):
-                    description = tag["content"].strip()
-                return title, description
-            except:
-                return '', ''
-
         tabs2 = st.tabs(["Загрузка", "Результаты"])
 
         with tabs2[0]:
@@ -1242,6 +2195,15 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             uploaded_file = st.file_uploader("Загрузите Excel-файл с данными:", type=["xlsx"], key="meta2_file")
+            meta2_fetch_cols = st.columns(2)
+            with meta2_fetch_cols[0]:
+                meta2_concurrency = st.number_input("Параллельных загрузок (всего)", min_value=1, max_value=100,
+                    value=DEFAULT_META_FETCH_CONCURRENCY, step=1, key="meta2_concurrency_input")
+            with meta2_fetch_cols[1]:
+                meta2_per_host = st.number_input("Параллельных загрузок на один хост", min_value=1, max_value=100,
+                    value=DEFAULT_META_FETCH_PER_HOST, step=1, key="meta2_per_host_input")
+            meta2_head_only = st.checkbox("Читать только <head> страницы (быстрее)", value=True, key="meta2_head_only_cb",
+                                          help="Загрузка обрывается после </head>: Title и Description там, остальная страница не скачивается.")
             if 'meta2_result_df' not in st.session_state:
                 st.session_state.meta2_result_df = None
 
@@ -1251,13 +2213,18 @@ def main():
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 results = []
-                total = len(df)
-                for index, row in df.iterrows():
-                    progress = (index + 1) / total
-                    progress_bar.progress(progress)
-                    status_text.text(f"Проверено {index + 1}/{total} URL")
-                    url = str(row['URL']).strip()
-                    url_ua = url.replace("apteka911.ua/", "apteka911.ua/ua/")
+                row_urls = [str(row_url).strip() for row_url in df['URL']]
+
+                def update_meta2_progress(done_count: int, total_count: int, url: str):
+                    progress_bar.progress(done_count / total_count)
+                    status_text.text(f"Загружено {done_count}/{total_count} страниц: {url}")
+
+                # RU и UA версии всех строк качаются одновременно в общем пуле соединений
+                meta_by_url = load_meta_for_urls(row_urls + [build_meta_ua_url(url) for url in row_urls],
+                                                 int(meta2_concurrency), int(meta2_per_host), update_meta2_progress,
+                                                 head_only=meta2_head_only)
+                for (index, row), url in zip(df.iterrows(), row_urls):
+                    url_ua = build_meta_ua_url(url)
                     row_result = {
                         'URL': url,
                         'Title RU (таблица)': row.get('Title RU', ''),
@@ -1266,30 +2233,37 @@ def main():
                         'Description UA (таблица)': row.get('Description UA', '')
                     }
                     # RU
-                    title_ru_site, desc_ru_site = get_meta_from_url(url)
+                    meta_ru = meta_by_url[url]
+                    title_ru_site, desc_ru_site = meta_ru['title'], meta_ru['description']
                     row_result['Title RU (сайт)'] = title_ru_site
                     row_result['Description RU (сайт)'] = desc_ru_site
                     # UA
-                    title_ua_site, desc_ua_site = get_meta_from_url(url_ua)
+                    meta_ua = meta_by_url[url_ua]
+                    title_ua_site, desc_ua_site = meta_ua['title'], meta_ua['description']
                     row_result['Title UA (сайт)'] = title_ua_site
                     row_result['Description UA (сайт)'] = desc_ua_site
-                    # Сходство
-                    title_ru_sim = get_similarity(clean_text(row.get('Title RU', '')), clean_text(title_ru_site))
-                    desc_ru_sim = get_similarity(clean_text(row.get('Description RU', '')), clean_text(desc_ru_site))
-                    title_ua_sim = get_similarity(clean_text(row.get('Title UA', '')), clean_text(title_ua_site))
-                    desc_ua_sim = get_similarity(clean_text(row.get('Description UA', '')), clean_text(desc_ua_site))
-                    row_result['Title RU Совпадение (%)'] = title_ru_sim
-                    row_result['Description RU Совпадение (%)'] = desc_ru_sim
-                    row_result['Title UA Совпадение (%)'] = title_ua_sim
-                    row_result['Description UA Совпадение (%)'] = desc_ua_sim
+                    row_result['RU ошибка'] = meta_ru['error'] or ''
+                    row_result['RU время, с'] = meta_ru['elapsed']
+                    row_result['UA ошибка'] = meta_ua['error'] or ''
+                    row_result['UA время, с'] = meta_ua['elapsed']
                     results.append(row_result)
                 status_text.text("Проверка завершена!")
                 result_df = pd.DataFrame(results)
+                if results:
+                    # Сходство — сразу по целым колонкам
+                    similarity_columns = {}
+                    for field_name in ['Title RU', 'Description RU', 'Title UA', 'Description UA']:
+                        expected_clean = normalize_batch(result_df[f'{field_name} (таблица)'], clean_meta_text)
+                        site_clean = normalize_batch(result_df[f'{field_name} (сайт)'], clean_meta_text)
+                        similarity_columns[f'{field_name} Совпадение (%)'] = batch_similarity(expected_clean, site_clean)
+                    error_columns = ['RU ошибка', 'RU время, с', 'UA ошибка', 'UA время, с']
+                    result_df = pd.concat([result_df.drop(columns=error_columns), pd.DataFrame(similarity_columns, index=result_df.index),
+                                           result_df[error_columns]], axis=1)
                 st.session_state.meta2_result_df = result_df
                 def highlight_percentage(p):
-                    if p >= 80:
+                    if p >= SIMILARITY_MATCH_THRESHOLD:
                         return f"✅ {p}%"
-                    elif p >= 50:
+                    elif p >= SIMILARITY_PARTIAL_THRESHOLD:
                         return f"🟡 {p}%"
                     else:
                         return f"❌ {p}%"
@@ -1305,16 +2279,16 @@ def main():
             st.subheader("📋 Результаты проверки")
             result_df = st.session_state.get('meta2_result_df', None)
             if result_df is not None:
-                min_similarity = st.slider("Минимальный процент совпадения", 0, 100, 50)
+                min_similarity = st.slider("Минимальный процент совпадения", 0, 100, SIMILARITY_PARTIAL_THRESHOLD)
                 filtered_df = result_df.copy()
                 filtered_df = filtered_df[(filtered_df['Title RU Совпадение (%)'] >= min_similarity) |
                                         (filtered_df['Description RU Совпадение (%)'] >= min_similarity) |
                                         (filtered_df['Title UA Совпадение (%)'] >= min_similarity) |
                                         (filtered_df['Description UA Совпадение (%)'] >= min_similarity)]
                 def highlight_percentage(p):
-                    if p >= 80:
+                    if p >= SIMILARITY_MATCH_THRESHOLD:
                         return f"✅ {p}%"
-                    elif p >= 50:
+                    elif p >= SIMILARITY_PARTIAL_THRESHOLD:
                         return f"🟡 {p}%"
                     else:
                         return f"❌ {p}%"
@@ -1334,6 +2308,18 @@ def main():
         st.title("🔎 Автоматизированный подбор ключей для семантического ядра")
 
         uploaded_file = st.file_uploader("Загрузи Excel-файл (.xlsx) с Названием, URL и Фразы", type=["xlsx"])
+        serpstat_cols = st.columns(3)
+        with serpstat_cols[0]:
+            serpstat_workers = st.slider("Параллельных строк", min_value=1, max_value=16, value=SERPSTAT_MAX_WORKERS,
+                                         help="Сколько строк обрабатывается одновременно.")
+        with serpstat_cols[1]:
+            serpstat_rps = st.number_input("Лимит запросов к API в секунду", min_value=0.1, max_value=50.0,
+                                           value=SERPSTAT_REQUESTS_PER_SECOND, step=0.5,
+                                           help="Должен соответствовать тарифу Serpstat.")
+        with serpstat_cols[2]:
+            serpstat_max_pages = st.number_input(f"Макс. страниц по {SERPSTAT_PAGE_SIZE} фраз", min_value=1, max_value=50,
+                                                 value=SERPSTAT_MAX_PAGES, step=1,
+                                                 help="Страницы запрашиваются, пока не наберётся топ-10 релевантных фраз.")
         start_button = st.button("🚀 Запустить обработку")
 
         if uploaded_file and start_button:
@@ -1346,13 +2332,29 @@ def main():
                     total = len(df)
                     progress_bar = st.progress(0)
                     status_text = st.empty()
-                    for idx, row in df.iterrows():
-                        name = str(row["Название"]).strip()
-                        phrases = get_serpstat_phrases_top_filtered(name, top_n=10)
-                        df.at[idx, "Фразы в точном вхождении"] = "\n".join(phrases) if phrases else "Нет данных"
-                        progress = (idx + 1) / total
-                        progress_bar.progress(progress)
-                        status_text.text(f"Обработано {idx+1} из {total}...")
+                    if not API_TOKEN:
+                        st.error("API-токен Serpstat не настроен. Проверь файл .env.")
+                        df["Фразы в точном вхождении"] = "Нет данных"
+                    get_serpstat_client().rate_limiter.set_rate(float(serpstat_rps))
+                    with ThreadPoolExecutor(max_workers=serpstat_workers) as executor:
+                        futures = {executor.submit(fetch_serpstat_phrases, str(row["Название"]).strip(), 10, SERPSTAT_PAGE_SIZE, int(serpstat_max_pages)): idx
+                                   for idx, row in df.iterrows()} if API_TOKEN else {}
+                        for done_count, future in enumerate(as_completed(futures), start=1):
+                            idx = futures[future]
+                            try:
+                                phrases = future.result()
+                            except SerpstatApiError as e:
+                                st.error(f"API Serpstat вернул ошибку для '{df.at[idx, 'Название']}': {str(e)}")
+                                phrases = []
+                            except requests.exceptions.RequestException as e:
+                                st.error(f"Ошибка подключения к API Serpstat для '{df.at[idx, 'Название']}': {str(e)}")
+                                phrases = []
+                            except Exception as e:
+                                st.error(f"Неожиданная ошибка при запросе к API для '{df.at[idx, 'Название']}': {str(e)}")
+                                phrases = []
+                            df.at[idx, "Фразы в точном вхождении"] = "\n".join(phrases) if phrases else "Нет данных"
+                            progress_bar.progress(done_count / total)
+                            status_text.text(f"Обработано {done_count} из {total}...")
                     progress_bar.progress(1.0)
                     status_text.text("✅ Готово! Можно скачивать результат.")
                     st.success("Готово! Скачай Excel ниже 👇")
@@ -1528,6 +2530,9 @@ def main():
                 value=st.session_state.get("manual_debug_url_val", ""), key="manual_debug_url_input_field")
             st.session_state.manual_debug_lang_val = st.sidebar.selectbox("Язык для отладки URL:", ["ru", "ua"],
                 index=['ru','ua'].index(st.session_state.get("manual_debug_lang_val", 'ru')), key="manual_debug_lang_select")
+            if st.sidebar.button("Очистить дисковый кэш страниц", key="clear_page_cache_btn"):
+                get_page_cache().clear()
+                st.sidebar.success("Дисковый кэш страниц очищен.")
             if st.sidebar.button("Сохранить HTML для URL", key="save_html_btn") and st.session_state.manual_debug_url_val:
                 st.sidebar.info(f"HTML для {st.session_state.manual_debug_lang_val.upper()}: {st.session_state.manual_debug_url_val}")
                 get_page_data_for_lang(st.session_state.manual_debug_url_val, st.session_state.manual_debug_lang_val,
@@ -1537,6 +2542,20 @@ def main():
 
         uploaded_file = st.file_uploader("📤 Загрузите Excel файл с данными", type=["xlsx"])
         if 'processed_data' not in st.session_state: st.session_state.processed_data = None
+        fetch_cols = st.columns(3)
+        with fetch_cols[0]:
+            page_fetch_concurrency = st.number_input("Параллельных загрузок (всего)", min_value=1, max_value=100,
+                value=DEFAULT_PAGE_FETCH_CONCURRENCY, step=1, key="page_fetch_concurrency_input")
+        with fetch_cols[1]:
+            page_fetch_per_host = st.number_input("Параллельных загрузок на один хост", min_value=1, max_value=100,
+                value=DEFAULT_PAGE_FETCH_PER_HOST, step=1, key="page_fetch_per_host_input")
+        with fetch_cols[2]:
+            page_parse_workers = st.number_input("Процессов для разбора HTML", min_value=1, max_value=64,
+                value=DEFAULT_PARSE_WORKERS, step=1, key="page_parse_workers_input",
+                help="1 — разбор в основном процессе без пула.")
+        page_fetch_meta_only = st.checkbox("Только Title/Description (без текста страниц и проверки фраз)", value=False,
+                                           key="page_fetch_meta_only_cb",
+                                           help="Страница читается до </head>: в разы меньше трафика и разбора, но фразы проверить нельзя.")
 
         if uploaded_file and st.button("🚀 Начать проверку всех URL из файла", key="start_full_processing_btn"):
             st.session_state.debug_messages = []
@@ -1565,7 +2584,18 @@ def main():
                 st.session_state.global_progress_value = 0.0
                 load_progress_text_ui.info(st.session_state.global_progress_text)
 
-                st.session_state.processed_data = load_all_pages_data_for_both_langs(df_excel, debug_mode)
+                def update_load_progress(progress_value: float, progress_text: str):
+                    load_progress_bar_ui.progress(progress_value)
+                    load_progress_text_ui.info(progress_text)
+
+                st.session_state.processed_data_token = uuid.uuid4().hex
+                st.session_state.processed_data = load_all_pages_data_for_both_langs(df_excel, debug_mode,
+                                                                                     max_concurrent=int(page_fetch_concurrency),
+                                                                                     per_host_limit=int(page_fetch_per_host),
+                                                                                     parse_workers=int(page_parse_workers),
+                                                                                     progress_callback=update_load_progress,
+                                                                                     meta_only=page_fetch_meta_only)
+                st.session_state.processed_data_meta_only = page_fetch_meta_only
 
                 load_progress_text_ui.success(st.session_state.get('global_progress_text', "Загрузка данных завершена!"))
                 load_progress_bar_ui.progress(st.session_state.get('global_progress_value', 1.0))
@@ -1596,17 +2626,23 @@ def main():
                 if 'df_excel' in locals() and df_excel is not None:
                     df_for_tabs_display = df_excel
                 else:
-                    df_for_tabs_display = pd.read_excel(uploaded_file)
+                    df_for_tabs_display = read_uploaded_excel(hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest(),
+                                                              uploaded_file.getvalue())
             except Exception as e_read_tabs:
                 st.error(f"Не удалось подготовить данные для отображения вкладок: {e_read_tabs}")
                 df_for_tabs_display = None
 
             if df_for_tabs_display is not None:
-                main_ru_tab, main_ua_tab = st.tabs(["🇷🇺 Русская Версия", "🇺🇦 Украинская Версия"])
-                with main_ru_tab:
-                    run_checks_for_language('ru', df_for_tabs_display, st.session_state.processed_data, debug_mode)
-                with main_ua_tab:
-                    run_checks_for_language('ua', df_for_tabs_display, st.session_state.processed_data, debug_mode)
+                uploaded_file_hash = hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+                processed_data_token = st.session_state.get('processed_data_token', '')
+                # st.tabs выполняет тела всех вкладок; радио-переключатель считает и рисует только выбранный язык,
+                # второй посчитается при переключении и останется в кэше результатов
+                language_labels = {'ru': "🇷🇺 Русская Версия", 'ua': "🇺🇦 Украинская Версия"}
+                selected_lang = st.radio("Версия сайта", list(language_labels), format_func=language_labels.get,
+                                         horizontal=True, key="seo_meta_lang_view", label_visibility="collapsed")
+                run_checks_for_language(selected_lang, df_for_tabs_display, st.session_state.processed_data, debug_mode,
+                                        uploaded_file_hash, processed_data_token,
+                                        st.session_state.get('processed_data_meta_only', False))
 
         if 'debug_mode' in locals() and debug_mode:
             display_debug_messages()
@@ -0,0 +1,72 @@
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+import pandas as pd
+
+# --- НОРМАЛИЗАЦИЯ ДЛЯ ПОИСКА (SEO Meta Checker) ---
+# Шаги и их порядок совпадают с прежней цепочкой re.sub: результат побайтно тот же.
+# Текст к этому моменту уже в нижнем регистре, поэтому вместо re.IGNORECASE (в разы медленнее на кириллице)
+# перечислены строчные символы, которые IGNORECASE считал равными буквам шаблона: ᲂ ᲄ ᲅ ᲀ ᲁ и латинская ı
+_SEARCH_PRICE_FROM_RE = re.compile('(цена [оᲂ][тᲄᲅ]|ціна [вᲀ]і[дᲁ]|pr[iı]ce from)' r'\s*[^-\|\n\r<]+?(\s*[-\|]|$)')
+_SEARCH_PRICE_PLACEHOLDER_RE = re.compile(r'%[a-z_]+price[a-z_]*%')
+_SEARCH_PLACEHOLDER_RE = re.compile(r'%[a-z_]+%')
+_SEARCH_AMOUNT_RE = re.compile(r'\d+(\.\d+)?\s*(грн|uah|usd|eur)?')
+_SEARCH_NON_WORD_RE = re.compile(r'[^\w\s]')
+# Разделители и zero-width space превращаются в пробел
+_SEARCH_SEPARATOR_CHARS = '/\\|-–—\u200b'
+
+# --- ОЧИСТКА МЕТА-ТЕГОВ (вкладка Tittle_Description +) ---
+_CLEAN_PRICE_FROM_RU_RE = re.compile(r'цена от [^|\n\r-]+')
+_CLEAN_PRICE_FROM_UA_RE = re.compile(r'цiна вiд [^|\n\r-]+')
+_CLEAN_CURRENCY_RE = re.compile(r'грн|uah')
+_CLEAN_DROP_CHARS = '-|:,⭐⏩⚡🔹📦→®'
+
+
+def _replace_chars(text: str, chars: str, replacement: str) -> str:
+    # Для кириллицы str.translate идёт по словарю посимвольно и медленнее нескольких str.replace (memchr в C)
+    for char in chars:
+        if char in text: text = text.replace(char, replacement)
+    return text
+
+
+def normalize_for_search(text: Optional[Any]) -> str:
+    if not text: return ""
+    text_str = str(text).lower()
+    text_str = _SEARCH_PRICE_FROM_RE.sub(' ', text_str)
+    if '%' in text_str:
+        text_str = _SEARCH_PRICE_PLACEHOLDER_RE.sub(' ', text_str)
+        text_str = _SEARCH_PLACEHOLDER_RE.sub(' ', text_str)
+    text_str = _SEARCH_AMOUNT_RE.sub(' ', text_str)
+    text_str = _replace_chars(text_str, _SEARCH_SEPARATOR_CHARS, ' ')
+    text_str = _SEARCH_NON_WORD_RE.sub('', text_str)
+    # split() без аргументов режет по тем же юникодным пробелам, что и \s, и заодно убирает края
+    return ' '.join(text_str.split())
+
+
+def clean_meta_text(text: Any) -> str:
+    text_str = str(text).lower()
+    text_str = text_str.replace('%min_price%', '')
+    if 'цена от ' in text_str: text_str = _CLEAN_PRICE_FROM_RU_RE.sub('', text_str)
+    if 'цiна вiд ' in text_str: text_str = _CLEAN_PRICE_FROM_UA_RE.sub('', text_str)
+    text_str = _replace_chars(text_str, _CLEAN_DROP_CHARS, '')
+    text_str = _CLEAN_CURRENCY_RE.sub('', text_str)
+    return ' '.join(text_str.split())
+
+
+def normalize_batch(texts: Union[Iterable[Any], pd.Series],
+                    normalizer: Callable[[Any], str] = normalize_for_search) -> Union[List[str], pd.Series]:
+    # Повторяющиеся значения (одинаковые Title/Description, фразы) нормализуются один раз
+    is_series = isinstance(texts, pd.Series)
+    values = texts.tolist() if is_series else list(texts)
+    normalized_by_value: Dict[Any, str] = {}
+    normalized_values = []
+    for value in values:
+        try:
+            normalized = normalized_by_value.get(value)
+            if normalized is None:
+                normalized = normalized_by_value[value] = normalizer(value)
+        except TypeError:
+            normalized = normalizer(value)
+        normalized_values.append(normalized)
+    if is_series:
+        return pd.Series(normalized_values, index=texts.index, name=texts.name, dtype=object)
+    return normalized_values
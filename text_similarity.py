@@ -0,0 +1,27 @@
+from typing import Any, Iterable, Union
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
+from rapidfuzz.process import cpdist
+
+# Пороги шкалы fuzz.ratio для вкладки «Tittle_Description +». Подобраны по benchmarks/similarity_bench.py под прежние
+# пороги SequenceMatcher: на строках до 200 символов те же 80/50 дают 99,6% и 99,9% совпадения корзин ✅/🟡/❌.
+# На более длинных строках SequenceMatcher включал autojunk и занижал оценку почти одинаковых текстов — там fuzz.ratio честнее
+SIMILARITY_MATCH_THRESHOLD = 80
+SIMILARITY_PARTIAL_THRESHOLD = 50
+
+
+def batch_similarity(left: Union[Iterable[Any], pd.Series], right: Union[Iterable[Any], pd.Series], workers: int = -1) -> np.ndarray:
+    # Попарное сходство строк двух колонок в процентах: fuzz.ratio (Indel-расстояние, на C и по всем ядрам),
+    # одинаковые пары считаются один раз
+    left_values = [str(value) for value in left]
+    right_values = [str(value) for value in right]
+    if len(left_values) != len(right_values):
+        raise ValueError(f"Колонки разной длины: {len(left_values)} и {len(right_values)}")
+    if not left_values:
+        return np.empty(0, dtype=np.float64)
+    pair_index = {}
+    positions = np.array([pair_index.setdefault(pair, len(pair_index)) for pair in zip(left_values, right_values)])
+    scores = cpdist([pair[0] for pair in pair_index], [pair[1] for pair in pair_index], scorer=fuzz.ratio,
+                    dtype=np.float64, workers=workers)
+    return np.round(scores, 1)[positions]